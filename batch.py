@@ -0,0 +1,36 @@
+import time
+from src.batch import FORMATS, run
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Render many pages without a window, in parallel")
+    parser.add_argument("sources", nargs="*",
+                        help="URLs or local HTML files")
+    parser.add_argument("--input", metavar="FILE",
+                        help="file listing more sources, one per line")
+    parser.add_argument("--output", metavar="DIR", required=True,
+                        help="directory for the rendered pages")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--format", choices=FORMATS, default="display",
+                        help="write each page's display list (default) or "
+                             "layout tree")
+    args = parser.parse_args()
+
+    sources = list(args.sources)
+    if args.input:
+        with open(args.input) as f:
+            sources.extend(line.strip() for line in f if line.strip())
+    if not sources:
+        parser.error("no sources given")
+
+    start = time.perf_counter()
+    summaries = run(sources, args.output, args.workers, args.format)
+    elapsed = time.perf_counter() - start
+    for summary in summaries:
+        if not summary["ok"]:
+            print("failed: {}  {}".format(summary["source"], summary["error"]))
+    failed = sum(not summary["ok"] for summary in summaries)
+    print("{} pages in {:.2f}s, {:.1f} pages/s, {} failed".format(
+        len(summaries), elapsed, len(summaries) / elapsed, failed))
@@ -0,0 +1,81 @@
+"""
+Fetching many documents from a slow local server: one after another with
+the blocking URL.request, and all at once with an AsyncFetcher.
+
+Usage:
+    python3 -m benchmarks.bench_async [--pages N] [--delay SECONDS]
+
+The server answers over chunked, gzipped HTTP/1.1 and pauses delay
+seconds after each response, standing in for network latency. The async
+fetcher keeps at most MAX_PER_HOST requests in flight to it.
+"""
+import asyncio
+import sys
+import time
+from src.aio import AsyncFetcher, MAX_PER_HOST
+from src.browse import URL, ConnectionPool
+from benchmarks.trickle_server import serve
+
+
+def blocking(urls):
+    pool = ConnectionPool()
+    return [url.request(pool=pool) for url in urls]
+
+
+async def concurrent(urls, fetcher):
+    try:
+        return await asyncio.gather(*[fetcher.request(url) for url in urls])
+    finally:
+        fetcher.close()
+
+
+async def timed_out(url):
+    fetcher = AsyncFetcher(timeout=0.01)
+    try:
+        await fetcher.request(url)
+    except asyncio.TimeoutError:
+        return True
+    finally:
+        fetcher.close()
+    return False
+
+
+def main(argv):
+    options = {"--pages": "24", "--delay": "0.05"}
+    for flag in options:
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    pages, delay = int(options["--pages"]), float(options["--delay"])
+
+    from benchmarks.bench_parse import synthetic_document
+    body = synthetic_document(200)
+    server = serve(body, chunk=1 << 20, delay=delay, compress=True,
+                   chunked=True)
+    base = "http://127.0.0.1:{}/".format(server.server_address[1])
+    urls = [URL(base + "page{}.html".format(i)) for i in range(pages)]
+
+    start = time.perf_counter()
+    serial = blocking(urls)
+    serial_time = time.perf_counter() - start
+
+    fetcher = AsyncFetcher()
+    start = time.perf_counter()
+    together = asyncio.run(concurrent(urls, fetcher))
+    async_time = time.perf_counter() - start
+
+    assert serial == together == [body] * pages
+    print("{} pages, {:.0f}ms server delay each".format(pages, delay * 1000))
+    print("blocking:  {:7.3f}s".format(serial_time))
+    print("async:     {:7.3f}s  ({} per host, {} connections opened, "
+          "{} reused)".format(async_time, MAX_PER_HOST, fetcher.opened,
+                              fetcher.reused))
+    print("speedup:   {:7.1f}x".format(serial_time / async_time))
+    print("timeout:   {}".format(
+        "raised" if asyncio.run(timed_out(urls[0])) else "NOT raised"))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
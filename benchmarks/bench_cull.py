@@ -0,0 +1,73 @@
+"""
+Viewport culling cost per scroll step: the display list index against a
+scan of the whole list, as the display list grows. Pages have either a
+background behind every 50 lines, or one behind every 7-line paragraph,
+as when p has a background color, so most backgrounds are tall commands.
+
+Usage:
+    python3 -m benchmarks.bench_cull
+
+Uses rectangles standing in for text, so no display is needed.
+"""
+import random
+import sys
+import time
+from src.utils import DisplayList, DisplayListIndex
+
+VIEWPORT = 600
+LINE = 18
+
+
+def synthetic_display_list(lines, block=50):
+    """
+    Lines of word-sized boxes, with a background behind every block of
+    lines.
+    """
+    random.seed(lines)
+    display_list = DisplayList()
+    for line in range(lines):
+        y = line * LINE
+        if line % block == 0:
+            display_list.append_rect(0, y, 800, y + block * LINE, "gray")
+        x = 0
+        for _ in range(8):
+            w = random.randint(20, 80)
+            display_list.append_rect(x, y, x + w, y + LINE - 2, "black")
+            x += w + 10
+    return display_list
+
+
+def scan(display_list, scroll):
+    return [i for i, (top, bottom) in enumerate(
+                zip(display_list.tops, display_list.bottoms))
+            if not top > scroll + VIEWPORT
+            and not bottom < scroll]
+
+
+def main(argv):
+    print("{:>12} {:>10} {:>12} {:>12}".format(
+        "backgrounds", "commands", "scan", "index"))
+    for block, lines in [(block, lines) for block in [50, 7]
+                         for lines in [1000, 10000, 100000]]:
+        display_list = synthetic_display_list(lines, block)
+        index = DisplayListIndex(display_list)
+        scrolls = [random.uniform(0, lines * LINE) for _ in range(50)]
+        for scroll in scrolls:
+            assert scan(display_list, scroll) == \
+                index.visible_indices(scroll, scroll + VIEWPORT)
+
+        start = time.perf_counter()
+        for scroll in scrolls:
+            scan(display_list, scroll)
+        scanned = (time.perf_counter() - start) / len(scrolls)
+        start = time.perf_counter()
+        for scroll in scrolls:
+            index.visible_indices(scroll, scroll + VIEWPORT)
+        indexed = (time.perf_counter() - start) / len(scrolls)
+        print("{:>12} {:>10} {:>10.3f}ms {:>10.3f}ms".format(
+            "every {}".format(block), len(display_list), scanned * 1000,
+            indexed * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
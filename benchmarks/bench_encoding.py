@@ -0,0 +1,42 @@
+"""
+Bytes on the wire and fetch time with and without gzip, over chunked
+HTTP/1.1 from a local server.
+
+Usage:
+    python3 -m benchmarks.bench_encoding [file.html]
+"""
+import sys
+import time
+from src.browse import URL
+from benchmarks.trickle_server import serve
+
+
+def fetch(body, compress):
+    server = serve(body, chunk=16384, delay=0, compress=compress,
+                   chunked=True)
+    url = URL("http://127.0.0.1:{}/".format(server.server_address[1]))
+    start = time.perf_counter()
+    text = url.request()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    return text, server.bytes_sent, elapsed
+
+
+def main(argv):
+    if argv:
+        with open(argv[0], "rb") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document().encode("utf8")
+
+    plain, plain_bytes, plain_time = fetch(body, False)
+    packed, packed_bytes, packed_time = fetch(body, True)
+    assert plain == packed == body.decode("utf8")
+    print("identity: {:>10} bytes  {:.3f}s".format(plain_bytes, plain_time))
+    print("gzip:     {:>10} bytes  {:.3f}s".format(packed_bytes, packed_time))
+    print("ratio:    {:>10.1f}x".format(plain_bytes / packed_bytes))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+"""
+Parsing a large local document three ways: read into one string and
+parsed, streamed from a file:// URL, and streamed over http from a
+local server.
+
+Usage:
+    python3 -m benchmarks.bench_file [file.html] [--paragraphs N]
+
+Peak memory is what tracemalloc sees at most during each load, so it
+includes the DOM; the difference between rows is the source text held
+at once. Without a file, a synthetic page is written to a temporary one.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from src.browse import URL, HTMLParser
+from benchmarks.trickle_server import serve
+
+
+def whole(path):
+    return HTMLParser(Path(path).read_text(encoding="utf8")).parse()
+
+
+def streamed(url):
+    parser = HTMLParser()
+    for chunk in url.stream():
+        parser.feed(chunk)
+    return parser.close()
+
+
+def measure(load, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    nodes = load(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(argv):
+    paragraphs = 5000
+    if "--paragraphs" in argv:
+        i = argv.index("--paragraphs")
+        paragraphs = int(argv[i + 1])
+        del argv[i:i + 2]
+    temporary = None
+    if argv:
+        path = argv[0]
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        fd, path = tempfile.mkstemp(suffix=".html")
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            f.write(synthetic_document(paragraphs))
+        temporary = path
+
+    with open(path, "rb") as f:
+        body = f.read()
+    server = serve(body, chunk=1 << 20, delay=0)
+    http = URL("http://127.0.0.1:{}/page.html".format(
+        server.server_address[1]))
+
+    print("document: {:.1f} MB".format(len(body) / 1e6))
+    del body
+    rows = [
+        ("read + parse", whole, path),
+        ("file:// stream", streamed, URL(Path(path).resolve().as_uri())),
+        ("http:// stream", streamed, http),
+    ]
+    for name, load, arg in rows:
+        elapsed, peak = measure(load, arg)
+        print("{:<15} {:7.3f}s  peak {:6.1f} MB".format(
+            name, elapsed, peak / 1e6))
+    server.shutdown()
+    if temporary:
+        os.remove(temporary)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
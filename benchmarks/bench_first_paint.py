@@ -0,0 +1,68 @@
+"""
+First-paint versus full-load latency over a slow connection.
+
+Usage:
+    python3 -m benchmarks.bench_first_paint [file.html]
+        [--chunk BYTES] [--delay SECONDS] [--tk]
+
+Serves the page through benchmarks.trickle_server and loads it in a
+headless Browser; pass --tk to load it in a real window, which needs a
+display.
+"""
+import sys
+import time
+from src.backend import HeadlessBackend, TkBackend
+from src.browse import URL
+from src.render import Browser
+from benchmarks.trickle_server import serve
+
+
+class TimedBrowser(Browser):
+    """
+    Records when each draw happens relative to the start of the load.
+    """
+    def load(self, url):
+        self.draw_times = []
+        self.start = time.perf_counter()
+        super().load(url)
+        self.done = time.perf_counter() - self.start
+
+    def draw(self):
+        super().draw()
+        self.draw_times.append(time.perf_counter() - self.start)
+
+
+def main(argv):
+    backend = HeadlessBackend()
+    if "--tk" in argv:
+        argv.remove("--tk")
+        backend = TkBackend()
+    options = {"--chunk": "4096", "--delay": "0.02"}
+    for flag in options:
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    if argv:
+        with open(argv[0], "rb") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document(500)
+
+    server = serve(body, chunk=int(options["--chunk"]),
+                   delay=float(options["--delay"]))
+    url = URL("http://127.0.0.1:{}/index.html".format(
+        server.server_address[1]))
+    browser = TimedBrowser(backend=backend)
+    browser.load(url)
+    server.shutdown()
+    browser.window.destroy()
+
+    print("document:    {:.2f} MB".format(len(body) / 1e6))
+    print("first paint: {:8.3f}s".format(browser.draw_times[0]))
+    print("full load:   {:8.3f}s".format(browser.done))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
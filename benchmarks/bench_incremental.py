@@ -0,0 +1,118 @@
+"""
+Cost of a one-node edit with incremental restyle and relayout, against a
+full style, layout and paint of the page.
+
+Usage:
+    python3 -m benchmarks.bench_incremental [file.html] [--edits N] [--tk]
+
+Edits change a text node, the inline style of an inline or block
+element, or add a stylesheet, and go through Browser.update and
+Browser.add_stylesheet. Afterwards the page's display list is checked
+against a full style, layout and paint of the edited tree.
+
+Fonts are measured by the headless backend; pass --tk to measure them
+with Tk, which needs a display.
+"""
+import random
+import sys
+import time
+from src.backend import HeadlessBackend, TkBackend
+from src.browse import HTMLParser, Element, Text, copy_tree
+from src.css import RuleIndex, style, cascade_priority
+from src.render import Browser, DEFAULT_STYLE_SHEET, BLOCK_ELEMENTS, \
+    DocumentLayout, paint_tree
+from src.utils import DisplayList, tree_to_list
+
+STYLESHEETS = [
+    "p { color: red } body { color: green }",
+    "li { font-weight: bold }",
+    "p { background-color: lightgray; font-size: 14px }",
+    "body { font-style: italic }",
+]
+
+
+def full_pipeline(nodes, index):
+    style(nodes, index)
+    document = DocumentLayout(nodes)
+    document.layout()
+    display_list = DisplayList()
+    paint_tree(document, display_list)
+    return display_list
+
+
+def edit(browser, node, i):
+    """
+    A one-node edit: new text, an inline style change, or every tenth
+    edit a new stylesheet.
+    """
+    if i % 10 == 9:
+        browser.add_stylesheet(STYLESHEETS[i // 10 % len(STYLESHEETS)])
+        return
+    if isinstance(node, Text):
+        node.set_text("edited text number {}".format(i))
+    else:
+        node.set_attribute("style", "color: red; font-size: {}px;".format(
+            12 + i % 8))
+    browser.update()
+
+
+def same_display_list(a, b):
+    return a.lefts == b.lefts and a.tops == b.tops \
+        and a.rights == b.rights and a.bottoms == b.bottoms \
+        and a.fonts == b.fonts and a.colors == b.colors \
+        and a.texts == b.texts
+
+
+def main(argv):
+    backend = HeadlessBackend()
+    if "--tk" in argv:
+        argv.remove("--tk")
+        backend = TkBackend()
+    edits = 50
+    if "--edits" in argv:
+        i = argv.index("--edits")
+        edits = int(argv[i + 1])
+        del argv[i:i + 2]
+    if argv:
+        with open(argv[0], encoding="utf8") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document(2000)
+
+    browser = Browser(backend=backend)
+    nodes = browser.nodes = HTMLParser(body).parse()
+    browser.rules = list(DEFAULT_STYLE_SHEET)
+    browser.rule_index = RuleIndex(sorted(browser.rules,
+                                          key=cascade_priority))
+
+    start = time.perf_counter()
+    full_pipeline(copy_tree(nodes), browser.rule_index)
+    full = time.perf_counter() - start
+
+    style(nodes, browser.rule_index)
+    browser.document = DocumentLayout(nodes)
+    browser.layout(None)
+
+    random.seed(0)
+    targets = [node for node in tree_to_list(nodes, [])
+               if isinstance(node, Text)
+               or (isinstance(node, Element)
+                   and node.tag in ["b", "i", "a"] + BLOCK_ELEMENTS)]
+    start = time.perf_counter()
+    for i in range(edits):
+        edit(browser, random.choice(targets), i)
+    incremental = (time.perf_counter() - start) / edits
+
+    expected = full_pipeline(copy_tree(nodes), browser.rule_index)
+    assert same_display_list(browser.display_list, expected), \
+        "incremental display list differs from a full run"
+    browser.window.destroy()
+
+    print("full pipeline:    {:8.2f}ms".format(full * 1000))
+    print("one-node edit:    {:8.2f}ms".format(incremental * 1000))
+    print("fraction of full: {:8.1%}".format(incremental / full))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
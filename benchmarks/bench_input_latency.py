@@ -0,0 +1,107 @@
+"""
+How long input waits while a large page loads: Browser.load on the
+window's thread against Browser.navigate, which fetches, parses and
+styles on a worker thread.
+
+Usage:
+    python3 -m benchmarks.bench_input_latency [file.html]
+        [--paragraphs N] [--chunk BYTES] [--delay SECONDS]
+
+The page comes from benchmarks.trickle_server. Input is simulated by a
+probe callback the window runs every PROBE_MS; how late each probe runs
+is how long a key press or scroll would have waited. Uses the headless
+backend, whose window runs timers like Tk's event loop.
+"""
+import statistics
+import sys
+import time
+from src.backend import HeadlessBackend
+from src.browse import URL
+from src.render import Browser
+from benchmarks.trickle_server import serve
+
+PROBE_MS = 10
+
+
+class TimedBrowser(Browser):
+    """
+    Records when the first draw happens.
+    """
+    def draw(self):
+        super().draw()
+        if self.first_draw is None:
+            self.first_draw = time.perf_counter()
+
+
+def measure(url, threaded):
+    browser = TimedBrowser(backend=HeadlessBackend())
+    browser.first_draw = None
+    window = browser.window
+    lateness = []
+    loaded = []
+
+    def probe(due):
+        now = time.perf_counter()
+        lateness.append(now - due)
+        document = getattr(browser, "document", None)
+        if loaded and document is not None and document.complete:
+            window.destroy()
+            return
+        window.after(PROBE_MS, probe, now + PROBE_MS / 1000)
+
+    def done():
+        loaded.append(time.perf_counter())
+
+    def blocking():
+        browser.load(url)
+        done()
+
+    start = time.perf_counter()
+    window.after(PROBE_MS, probe, start + PROBE_MS / 1000)
+    if threaded:
+        browser.navigate(url, done)
+    else:
+        window.after(0, blocking)
+    window.mainloop()
+    end = time.perf_counter()
+    return {
+        "first draw": browser.first_draw - start,
+        "loaded": loaded[0] - start,
+        "laid out": end - start,
+        "lateness": sorted(lateness),
+    }
+
+
+def main(argv):
+    options = {"--paragraphs": "3000", "--chunk": "16384", "--delay": "0.005"}
+    for flag in options:
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    if argv:
+        with open(argv[0], "rb") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document(int(options["--paragraphs"]))
+
+    server = serve(body, chunk=int(options["--chunk"]),
+                   delay=float(options["--delay"]))
+    url = URL("http://127.0.0.1:{}/index.html".format(
+        server.server_address[1]))
+    print("{:<10} {:>11} {:>9} {:>9}   input delay (p50 / p95 / max)".format(
+        "", "first draw", "loaded", "laid out"))
+    for name, threaded in [("load", False), ("navigate", True)]:
+        result = measure(url, threaded)
+        late = result["lateness"]
+        print("{:<10} {:>10.3f}s {:>8.3f}s {:>8.3f}s   "
+              "{:6.1f} / {:6.1f} / {:6.1f} ms".format(
+                  name, result["first draw"], result["loaded"],
+                  result["laid out"], statistics.median(late) * 1000,
+                  late[int(len(late) * 0.95)] * 1000, late[-1] * 1000))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
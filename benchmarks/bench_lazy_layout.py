@@ -0,0 +1,99 @@
+"""
+Time to first draw on a book-length page with viewport-first layout,
+against laying out the whole page up front.
+
+Usage:
+    python3 -m benchmarks.bench_lazy_layout [file.html] [--paragraphs N]
+        [--tk]
+
+Also reports how long the background layout takes to finish, its
+longest single slice (how long an event can wait behind it), and the
+cost of jumping to the middle of the page before it has got there.
+Uses the headless backend unless given --tk.
+"""
+import sys
+import time
+from src.backend import HeadlessBackend, TkBackend
+from src.browse import HTMLParser
+from src.render import Browser, DocumentLayout, paint_tree
+from src.utils import DisplayList
+
+
+class TimedBrowser(Browser):
+    """
+    Records how long each background layout slice takes.
+    """
+    def layout_more(self):
+        start = time.perf_counter()
+        super().layout_more()
+        self.slices.append(time.perf_counter() - start)
+
+
+def open_page(backend, body):
+    browser = TimedBrowser(backend=backend)
+    browser.url = None
+    browser.stylesheets = {}
+    browser.timings = []
+    browser.slices = []
+    browser.nodes = HTMLParser(body).parse()
+    return browser
+
+
+def main(argv):
+    backend = HeadlessBackend()
+    if "--tk" in argv:
+        argv.remove("--tk")
+        backend = TkBackend()
+    paragraphs = 5000
+    if "--paragraphs" in argv:
+        i = argv.index("--paragraphs")
+        paragraphs = int(argv[i + 1])
+        del argv[i:i + 2]
+    if argv:
+        with open(argv[0], encoding="utf8") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document(paragraphs)
+
+    # Whole page up front, as render() used to
+    browser = open_page(backend, body)
+    browser.render()
+    start = time.perf_counter()
+    document = DocumentLayout(browser.nodes)
+    document.layout()
+    paint_tree(document, DisplayList())
+    eager = time.perf_counter() - start
+    browser.window.destroy()
+
+    browser = open_page(backend, body)
+    start = time.perf_counter()
+    browser.render()
+    first = time.perf_counter() - start
+    partial = browser.document.height
+    start = time.perf_counter()
+    browser.window.update()
+    finish = time.perf_counter() - start
+    full = browser.document.height
+    browser.window.destroy()
+
+    # Jump halfway down before any background layout has run
+    jump = open_page(backend, body)
+    jump.render()
+    jump.scroll = full / 2
+    start = time.perf_counter()
+    jump.draw()
+    forced = time.perf_counter() - start
+    jump.window.destroy()
+
+    print("page height:      {:10.0f}px".format(full))
+    print("eager layout:     {:10.3f}s".format(eager))
+    print("first draw:       {:10.3f}s  ({:.0f}px laid out)".format(
+        first, partial))
+    print("background:       {:10.3f}s  in {} slices, longest {:.1f}ms".format(
+        finish, len(browser.slices), max(browser.slices, default=0) * 1000))
+    print("jump to middle:   {:10.3f}s".format(forced))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+"""
+Font calls made by layout and paint with the measurement caches, against
+the one call per measure()/metrics() request made before them.
+
+Usage:
+    python3 -m benchmarks.bench_measure [file.html] [--tk]
+
+Fonts are measured by the headless backend; pass --tk to measure them
+with Tk, which needs a display.
+"""
+import sys
+import time
+from src.backend import HeadlessBackend, TkBackend
+from src.browse import HTMLParser
+from src.css import RuleIndex, style, cascade_priority
+from src.render import DEFAULT_STYLE_SHEET, DocumentLayout, paint_tree
+from src.utils import DisplayList, MEASURE_STATS, reset_measure_stats, \
+    set_backend
+
+
+def main(argv):
+    backend = HeadlessBackend()
+    if "--tk" in argv:
+        argv.remove("--tk")
+        backend = TkBackend()
+    if argv:
+        with open(argv[0], encoding="utf8") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document(2000)
+
+    window = backend.create_window("benchmark")
+    set_backend(backend)
+    nodes = HTMLParser(body).parse()
+    style(nodes, RuleIndex(sorted(DEFAULT_STYLE_SHEET, key=cascade_priority)))
+    reset_measure_stats()
+    start = time.perf_counter()
+    document = DocumentLayout(nodes)
+    document.layout()
+    paint_tree(document, DisplayList())
+    elapsed = time.perf_counter() - start
+    window.destroy()
+
+    stats = MEASURE_STATS
+    requests = sum(stats.values())
+    tk_calls = stats["width_misses"] + stats["metrics_misses"]
+    print("layout and paint: {:8.2f}ms".format(elapsed * 1000))
+    print("widths:  {width_hits} hits, {width_misses} misses".format(**stats))
+    print("metrics: {metrics_hits} hits, {metrics_misses} misses".format(
+        **stats))
+    print("font calls: {} instead of {} ({:.1%})".format(
+        tk_calls, requests, tk_calls / requests if requests else 0))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
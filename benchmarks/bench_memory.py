@@ -0,0 +1,100 @@
+"""
+Memory held by a large page after each stage: the DOM, computed styles,
+the layout tree and the display list, plus the process's peak RSS.
+
+Usage:
+    python3 -m benchmarks.bench_memory [file.html] [--paragraphs N]
+
+Each stage's figure is what tracemalloc still sees allocated once it
+finishes, so it counts what the page keeps, not temporaries. Peak RSS
+comes from a separate, untraced run in a fresh interpreter. Fonts come
+from the headless backend, so no display is needed.
+"""
+import resource
+import subprocess
+import sys
+import tracemalloc
+from src.backend import HeadlessBackend
+from src.browse import HTMLParser
+from src.css import RuleIndex, style, cascade_priority
+from src.render import DEFAULT_STYLE_SHEET, DocumentLayout, paint_tree
+from src.utils import DisplayList, set_backend
+
+
+def pipeline(body, after=None):
+    """
+    Parses, styles, lays out and paints body, calling after(stage) once
+    each stage is done. Returns everything the page holds on to.
+    """
+    nodes = HTMLParser(body).parse()
+    if after: after("dom")
+    style(nodes, RuleIndex(sorted(DEFAULT_STYLE_SHEET, key=cascade_priority)))
+    if after: after("style")
+    document = DocumentLayout(nodes)
+    document.layout()
+    if after: after("layout")
+    display_list = DisplayList()
+    paint_tree(document, display_list)
+    if after: after("display list")
+    return nodes, document, display_list
+
+
+def load_body(argv):
+    paragraphs = 5000
+    if "--paragraphs" in argv:
+        i = argv.index("--paragraphs")
+        paragraphs = int(argv[i + 1])
+        del argv[i:i + 2]
+    if argv:
+        with open(argv[0], encoding="utf8") as f:
+            return f.read()
+    from benchmarks.bench_parse import synthetic_document
+    return synthetic_document(paragraphs)
+
+
+def peak_rss(argv):
+    """
+    Runs the pipeline untraced in this process, prints peak RSS in KB.
+    """
+    set_backend(HeadlessBackend())
+    body = load_body(argv)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    page = pipeline(body)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(before, after)
+
+
+def main(argv):
+    if argv and argv[0] == "--rss":
+        return peak_rss(argv[1:])
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_memory", "--rss"] + argv,
+        capture_output=True, text=True, check=True)
+    rss_before, rss_after = [int(kb) for kb in out.stdout.split()]
+
+    set_backend(HeadlessBackend())
+    body = load_body(argv)
+    held = {}
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+
+    def after(stage):
+        held[stage] = tracemalloc.get_traced_memory()[0] - base
+
+    nodes, document, display_list = pipeline(body, after)
+    tracemalloc.stop()
+
+    words = sum(len(text.split()) for text in display_list.texts if text)
+    previous = 0
+    for stage, size in held.items():
+        print("{:<13} {:8.1f}MB  {:6.0f} bytes/word".format(
+            stage, (size - previous) / 1e6, (size - previous) / words))
+        previous = size
+    print("{:<13} {:8.1f}MB  {:6.0f} bytes/word".format(
+        "total", previous / 1e6, previous / words))
+    print("peak RSS      {:8.1f}MB  (+{:.1f}MB for the page)".format(
+        rss_after / 1024, (rss_after - rss_before) / 1024))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,180 @@
+"""
+Parse-throughput benchmark for HTMLParser.
+
+Usage:
+    python3 -m benchmarks.bench_parse [file.html] [--repeat N]
+
+Without a file, a synthetic multi-megabyte document is generated. The
+legacy character-at-a-time loop is timed alongside the tokenizer and both
+trees are compared node for node.
+"""
+import sys
+import time
+from src.browse import HTMLParser, Element, Text
+
+
+class LegacyHTMLParser:
+    """
+    The original parser: the character-at-a-time loop and the tree
+    building it drove, kept as they were for comparison.
+    """
+    def __init__(self, body):
+        self.body = body
+        self.unfinished = []
+        self.SELF_CLOSING_TAGS = [
+            "area", "base", "br", "col", "embed", "hr", "img", "input",
+            "link", "meta", "param", "source", "track", "wbr"
+            ]
+        self.HEAD_TAGS = [
+            "base", "basefont", "bgsound", "noscript",
+            "link", "meta", "title", "style", "script"
+        ]
+
+    def get_attributes(self, text):
+        parts = text.split()
+        tag = parts[0].casefold()
+        attributes = {}
+        for attrpair in parts[1:]:
+            if "=" in attrpair:
+                key, value = attrpair.split("=", 1)
+                if len(value) > 2 and value[0] in ["'", "\""]:
+                    value = value[1:-1]
+                attributes[key.casefold()] = value
+            else:
+                attributes[attrpair.casefold()] = ""
+        return tag, attributes
+
+    def parse(self):
+        text = ""
+        in_tag = False
+        for c in self.body:
+            if c == "<":
+                in_tag = True
+                if text: self.add_text(text)
+                text = ""
+            elif c == ">":
+                in_tag = False
+                self.add_tag(text)
+                text = ""
+            else:
+                text += c
+        if not in_tag and text:
+            self.add_text(text)
+        return self.finish()
+
+    def add_text(self, text):
+        if text.isspace(): return
+        self.implicit_tags(None)
+        parent = self.unfinished[-1]
+        node = Text(text, parent)
+        parent.children.append(node)
+
+    def add_tag(self, tag):
+        tag, attributes = self.get_attributes(tag)
+        if tag.startswith("!"): return
+        self.implicit_tags(tag)
+        if tag.startswith("/"):
+            if len(self.unfinished) == 1: return
+            node = self.unfinished.pop()
+            parent = self.unfinished[-1]
+            parent.children.append(node)
+        elif tag in self.SELF_CLOSING_TAGS:
+            parent = self.unfinished[-1]
+            node = Element(tag, attributes, parent)
+            parent.children.append(node)
+        else:
+            parent = self.unfinished[-1] if self.unfinished else None
+            node = Element(tag, attributes, parent)
+            self.unfinished.append(node)
+
+    def finish(self):
+        if not self.unfinished:
+            self.implicit_tags(None)
+        while len(self.unfinished) > 1:
+            node = self.unfinished.pop()
+            parent = self.unfinished[-1]
+            parent.children.append(node)
+        return self.unfinished.pop()
+
+    def implicit_tags(self, tag):
+        while True:
+            open_tags = [node.tag for node in self.unfinished]
+            if open_tags == [] and tag != "html":
+                self.add_tag("html")
+            elif open_tags == ["html"] \
+                and tag not in ["head", "body", "/html"]:
+                if tag in self.HEAD_TAGS:
+                    self.add_tag("head")
+                else:
+                    self.add_tag("body")
+            elif open_tags == ["html", "head"] and \
+                tag not in ["/head"] + self.HEAD_TAGS:
+                self.add_tag("/head")
+            else:
+                break
+
+
+def synthetic_document(paragraphs=5000):
+    """
+    Builds a large page of styled paragraphs, lists and links.
+    """
+    out = ["<!doctype html><html><head><title>Bench</title>",
+           "<link rel=stylesheet href=style.css></head><body>"]
+    for i in range(paragraphs):
+        out.append("<p class=\"para\">Paragraph {} has <b>bold</b>, "
+                   "<i>italic</i> and <a href=\"/page/{}\">a link</a> "
+                   "among plain words &amp; entities. ".format(i, i))
+        out.append("Lorem ipsum dolor sit amet, consectetur adipiscing "
+                   "elit, sed do eiusmod tempor incididunt ut labore. " * 4)
+        out.append("</p>\n")
+        if i % 50 == 0:
+            out.append("<ul>" + "<li>item</li>" * 10 + "</ul><br>\n")
+    out.append("</body></html>")
+    return "".join(out)
+
+
+def same_tree(a, b):
+    if type(a) is not type(b) or len(a.children) != len(b.children):
+        return False
+    if isinstance(a, Text):
+        if a.text != b.text: return False
+    elif a.tag != b.tag or a.attributes != b.attributes:
+        return False
+    return all(same_tree(x, y) for x, y in zip(a.children, b.children))
+
+
+def best_time(parser_class, body, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tree = parser_class(body).parse()
+        best = min(best, time.perf_counter() - start)
+    return best, tree
+
+
+def main(argv):
+    repeat = 3
+    if "--repeat" in argv:
+        i = argv.index("--repeat")
+        repeat = int(argv[i + 1])
+        del argv[i:i + 2]
+    if argv:
+        with open(argv[0], encoding="utf8") as f:
+            body = f.read()
+    else:
+        body = synthetic_document()
+
+    mb = len(body.encode("utf8")) / 1e6
+    print("document: {:.2f} MB".format(mb))
+    legacy_time, legacy_tree = best_time(LegacyHTMLParser, body, repeat)
+    new_time, new_tree = best_time(HTMLParser, body, repeat)
+    print("legacy:    {:8.3f}s  {:7.2f} MB/s".format(
+        legacy_time, mb / legacy_time))
+    print("tokenizer: {:8.3f}s  {:7.2f} MB/s".format(
+        new_time, mb / new_time))
+    print("speedup:   {:8.2f}x".format(legacy_time / new_time))
+    print("identical trees:", same_tree(legacy_tree, new_tree))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,70 @@
+"""
+Resize latency on a large page: reflowing the existing layout tree at a
+new width against building a fresh DocumentLayout, as resizing used to.
+
+Usage:
+    python3 -m benchmarks.bench_resize [file.html] [--tk]
+
+Fonts are measured by the headless backend; pass --tk to measure them
+with Tk, which needs a display.
+"""
+import sys
+import time
+import src.render as render
+from src.backend import HeadlessBackend, TkBackend
+from src.browse import HTMLParser
+from src.css import RuleIndex, style, cascade_priority
+from src.render import DEFAULT_STYLE_SHEET, DocumentLayout, paint_tree
+from src.utils import DisplayList, set_backend
+
+WIDTHS = [640, 720, 800, 960, 1024, 1280]
+
+
+def repaint(document):
+    display_list = DisplayList()
+    paint_tree(document, display_list)
+    return display_list
+
+
+def main(argv):
+    backend = HeadlessBackend()
+    if "--tk" in argv:
+        argv.remove("--tk")
+        backend = TkBackend()
+    if argv:
+        with open(argv[0], encoding="utf8") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document(2000)
+
+    window = backend.create_window("benchmark")
+    set_backend(backend)
+    nodes = HTMLParser(body).parse()
+    style(nodes, RuleIndex(sorted(DEFAULT_STYLE_SHEET, key=cascade_priority)))
+    document = DocumentLayout(nodes)
+    document.layout()
+
+    rebuild = reflow = 0
+    for width in WIDTHS:
+        render.WIDTH = width
+        start = time.perf_counter()
+        fresh = DocumentLayout(nodes)
+        fresh.layout()
+        repaint(fresh)
+        rebuild += time.perf_counter() - start
+
+        start = time.perf_counter()
+        document.layout()
+        repaint(document)
+        reflow += time.perf_counter() - start
+    window.destroy()
+
+    print("fresh layout per resize: {:8.2f}ms".format(
+        rebuild / len(WIDTHS) * 1000))
+    print("reflow per resize:       {:8.2f}ms".format(
+        reflow / len(WIDTHS) * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
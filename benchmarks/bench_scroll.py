@@ -0,0 +1,61 @@
+"""
+Scroll cost on a real Tk canvas: retained canvas items moved across
+scroll steps, against deleting and recreating everything visible each
+step as draw() used to.
+
+Usage:
+    python3 -m benchmarks.bench_scroll [--steps N]
+
+A display is required.
+"""
+import sys
+import time
+import tkinter
+from types import SimpleNamespace
+from src.render import Browser, HEIGHT
+from src.utils import DisplayListIndex
+from benchmarks.bench_cull import synthetic_display_list
+
+
+def immediate(state):
+    state.canvas.delete("all")
+    for cmd in state.display_index.visible(state.scroll, state.scroll + HEIGHT):
+        cmd.execute(state.scroll, state.canvas)
+
+
+def run(draw, display_list, canvas, steps):
+    state = SimpleNamespace(
+        canvas=canvas, display_list=display_list,
+        display_index=DisplayListIndex(display_list),
+        items={}, band=None, drawn_scroll=0, scroll=0)
+    canvas.delete("all")
+    first = canvas.create_line(0, 0, 0, 0)
+    start = time.perf_counter()
+    for step in range(steps):
+        state.scroll = step * 40
+        draw(state)
+        canvas.update_idletasks()
+    elapsed = time.perf_counter() - start
+    created = canvas.create_line(0, 0, 0, 0) - first - 1
+    return elapsed / steps, created / steps
+
+
+def main(argv):
+    steps = 200
+    if "--steps" in argv:
+        steps = int(argv[argv.index("--steps") + 1])
+    root = tkinter.Tk()
+    canvas = tkinter.Canvas(root, width=800, height=HEIGHT)
+    canvas.pack()
+    display_list = synthetic_display_list(5000)
+
+    for name, draw in [("delete-all", immediate),
+                       ("retained", Browser.draw_retained)]:
+        per_step, created = run(draw, display_list, canvas, steps)
+        print("{:>10}: {:8.2f}ms per step, {:8.1f} items created".format(
+            name, per_step * 1000, created))
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,81 @@
+"""
+Opening a large page cold, with no snapshot, against opening it warm
+from the snapshot saved by the cold open.
+
+Usage:
+    python3 -m benchmarks.bench_snapshot [file.html] [--paragraphs N]
+
+Times are to the first draw and to when the page is usable, meaning
+loaded, with the whole page either laid out or on screen from a
+snapshot that was confirmed current. The page is read from a file://
+URL and snapshots go to a temporary directory. Uses the headless
+backend.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from src.backend import HeadlessBackend
+from src.browse import URL
+from src.cache import SnapshotStore
+from src.render import Browser
+
+
+class TimedBrowser(Browser):
+    """
+    Records when the first draw happens.
+    """
+    def draw(self):
+        super().draw()
+        if self.first_draw is None:
+            self.first_draw = time.perf_counter()
+
+
+def open_page(url, store):
+    browser = TimedBrowser(backend=HeadlessBackend(), snapshots=store)
+    browser.first_draw = None
+    start = time.perf_counter()
+    browser.load(url)
+    browser.window.update() # Finish any background layout
+    end = time.perf_counter()
+    result = (browser.first_draw - start, end - start, len(browser.display_list),
+              browser.document is None)
+    browser.window.destroy()
+    return result
+
+
+def main(argv):
+    paragraphs = 5000
+    if "--paragraphs" in argv:
+        i = argv.index("--paragraphs")
+        paragraphs = int(argv[i + 1])
+        del argv[i:i + 2]
+    directory = tempfile.mkdtemp()
+    if argv:
+        path = argv[0]
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        path = os.path.join(directory, "page.html")
+        with open(path, "w", encoding="utf8") as f:
+            f.write(synthetic_document(paragraphs))
+    url = URL(Path(path).resolve().as_uri())
+    store = SnapshotStore(os.path.join(directory, "snapshots"))
+
+    cold = open_page(url, store)
+    size = sum(f.stat().st_size for f in store.directory.iterdir())
+    warm = open_page(url, store)
+    assert warm[2] == cold[2] and warm[3], "snapshot not used"
+
+    print("{} commands, snapshot {:.1f} MB on disk".format(cold[2], size / 1e6))
+    print("{:<6} {:>11} {:>9}".format("", "first draw", "usable"))
+    for name, (first, usable, commands, kept) in [("cold", cold),
+                                                  ("warm", warm)]:
+        print("{:<6} {:>10.3f}s {:>8.3f}s".format(name, first, usable))
+    print("warm usable {:.1f}x sooner".format(cold[1] / warm[1]))
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,75 @@
+"""
+Cold-start import time of src.render with and without compiled
+stylesheets, and parse versus cached load for a large stylesheet.
+
+Usage:
+    python3 -m benchmarks.bench_startup [--repeat N]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from src.cache import StylesheetCache
+from src.css import CSSParser
+from benchmarks.bench_style import synthetic_stylesheet
+
+IMPORT = "import time; t = time.perf_counter(); import src.render; " \
+    "print(time.perf_counter() - t)"
+
+
+def import_time(home, repeat):
+    """
+    Best import time of src.render in a fresh interpreter whose home
+    directory, and so stylesheet cache, is home.
+    """
+    env = dict(os.environ, HOME=home)
+    times = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", IMPORT], env=env,
+                             capture_output=True, text=True, check=True)
+        times.append(float(out.stdout))
+    return min(times)
+
+
+def best_time(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv):
+    repeat = 5
+    if "--repeat" in argv:
+        repeat = int(argv[argv.index("--repeat") + 1])
+
+    with tempfile.TemporaryDirectory() as home:
+        # Each cold run gets an empty cache; warm runs share one
+        cold = min(import_time(tempfile.mkdtemp(dir=home), 1)
+                   for _ in range(repeat))
+        warm_home = tempfile.mkdtemp(dir=home)
+        import_time(warm_home, 1)
+        warm = import_time(warm_home, repeat)
+    print("import src.render, cold: {:8.1f}ms".format(cold * 1000))
+    print("import src.render, warm: {:8.1f}ms".format(warm * 1000))
+
+    text = synthetic_stylesheet(5000)
+    with tempfile.TemporaryDirectory() as directory:
+        StylesheetCache(directory).parse(text)
+        parse = best_time(lambda: CSSParser(text).parse(), repeat)
+        disk = best_time(lambda: StylesheetCache(directory).parse(text),
+                         repeat)
+        cache = StylesheetCache(directory)
+        cache.parse(text)
+        memory = best_time(lambda: cache.parse(text), repeat)
+    print("{} byte stylesheet:".format(len(text)))
+    print("  CSSParser:        {:8.2f}ms".format(parse * 1000))
+    print("  compiled on disk: {:8.2f}ms".format(disk * 1000))
+    print("  in memory:        {:8.2f}ms".format(memory * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,142 @@
+"""
+Style-recalc benchmark: style() with its rule index, ancestor filter and
+style sharing against the original match-every-rule-on-every-node loop.
+
+Usage:
+    python3 -m benchmarks.bench_style [file.html] [--repeat N]
+
+The default stylesheet is extended with a few hundred synthetic tag and
+descendant rules, and both computed styles are compared node for node.
+Without a file, a text page and a large list-and-table page are run.
+"""
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from src.browse import HTMLParser, Element
+from src.css import CSSParser, INHERITED_PROPERTIES, style, cascade_priority
+from src.utils import tree_to_list
+
+CSS_PATH = Path(__file__).resolve().parent.parent / "assets" / "browser.css"
+TAGS = ["div", "p", "span", "a", "b", "i", "li", "ul", "td", "section",
+        "article", "em", "strong", "h1", "h2", "blockquote"]
+
+
+def legacy_style(node, rules):
+    """
+    The original style(): every rule tested on every node.
+    """
+    node.style = {}
+    for property, default_value in INHERITED_PROPERTIES.items():
+        if node.parent:
+            node.style[property] = node.parent.style[property]
+        else:
+            node.style[property] = default_value
+    for selector, body in rules:
+        if not selector.matches(node): continue
+        for property, value in body.items():
+            node.style[property] = value
+    if isinstance(node, Element) and "style" in node.attributes:
+        pairs = CSSParser(node.attributes["style"]).body()
+        for property, value in pairs.items():
+            node.style[property] = value
+    if node.style["font-size"].endswith("%"):
+        if node.parent:
+            parent_font_size = node.parent.style["font-size"]
+        else:
+            parent_font_size = INHERITED_PROPERTIES["font-size"]
+        node_pct = float(node.style["font-size"][:-1]) / 100
+        parent_px = float(parent_font_size[:-2])
+        node.style["font-size"] = str(node_pct * parent_px) + "px"
+    for child in node.children:
+        legacy_style(child, rules)
+
+
+def synthetic_stylesheet(count=300):
+    rules = []
+    for i in range(count):
+        tags = [TAGS[(i * 7 + j * 3) % len(TAGS)] for j in range(1 + i % 3)]
+        rules.append("{} {{ color: c{}; background-color: b{}; }}".format(
+            " ".join(tags), i, i))
+    return "\n".join(rules)
+
+
+def table_document(rows=3000):
+    """
+    Long lists and wide tables of identical siblings.
+    """
+    out = ["<html><body><ul>"]
+    out.append("<li>list <a href=#>item</a> text</li>" * rows)
+    out.append("</ul><table>")
+    for i in range(rows):
+        out.append("<tr>" + "<td>cell <b>{}</b></td>".format(i) * 8 + "</tr>")
+    out.append("</table></body></html>")
+    return "".join(out)
+
+
+def style_memory(function, nodes, rules):
+    """
+    Bytes still allocated after styling, i.e. held by the computed styles.
+    """
+    for node in tree_to_list(nodes, []):
+        node.style = None
+    tracemalloc.start()
+    function(nodes, rules)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def best_time(function, nodes, rules, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(nodes, rules)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(name, body, rules, repeat):
+    nodes = HTMLParser(body).parse()
+    count = len(tree_to_list(nodes, []))
+
+    legacy_time = best_time(legacy_style, nodes, rules, repeat)
+    legacy_memory = style_memory(legacy_style, nodes, rules)
+    expected = [node.style for node in tree_to_list(nodes, [])]
+    new_time = best_time(style, nodes, rules, repeat)
+    new_memory = style_memory(style, nodes, rules)
+    sharing = style(nodes, rules)
+    actual = [node.style for node in tree_to_list(nodes, [])]
+
+    print("{}: {} nodes, {} rules".format(name, count, len(rules)))
+    print("  legacy:   {:8.3f}s {:8.1f} KB".format(
+        legacy_time, legacy_memory / 1024))
+    print("  indexed:  {:8.3f}s {:8.1f} KB".format(
+        new_time, new_memory / 1024))
+    print("  speedup:  {:8.2f}x".format(legacy_time / new_time))
+    print("  sharing:  {:8.1%} hit rate".format(sharing.hit_rate()))
+    print("  identical styles:", expected == actual)
+
+
+def main(argv):
+    repeat = 3
+    if "--repeat" in argv:
+        i = argv.index("--repeat")
+        repeat = int(argv[i + 1])
+        del argv[i:i + 2]
+    with open(CSS_PATH) as f:
+        rules = CSSParser(f.read()).parse()
+    rules.extend(CSSParser(synthetic_stylesheet()).parse())
+    rules = sorted(rules, key=cascade_priority)
+
+    if argv:
+        with open(argv[0], encoding="utf8") as f:
+            run(argv[0], f.read(), rules, repeat)
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        run("text", synthetic_document(2000), rules, repeat)
+        run("lists and tables", table_document(), rules, repeat)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
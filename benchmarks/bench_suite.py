@@ -0,0 +1,272 @@
+"""
+End-to-end benchmark over a corpus of local pages: each stage of the
+pipeline timed on its own, with throughput and peak memory, written as
+JSON and compared against a stored baseline.
+
+Usage:
+    python3 -m benchmarks.bench_suite [--repeat N] [--pages a,b,...]
+        [--output results.json] [--baseline baseline.json]
+        [--save-baseline] [--threshold 0.1]
+
+The corpus is the handwritten pages in benchmarks/corpus plus generated
+ones: large, deeply nested, wide and table-heavy, each with its own
+stylesheet. Fonts come from the headless backend, so no display is
+needed and text widths are the same on every machine.
+
+Every stage is the best of --repeat runs. Peak memory is measured in a
+separate run under tracemalloc, which would otherwise skew the times.
+With a baseline (benchmarks/baseline.json unless given), stages more
+than --threshold slower are reported and the exit status is 1.
+--save-baseline writes this run's results there instead.
+"""
+import json
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from src.backend import HeadlessBackend
+from src.browse import HTMLParser
+from src.css import CSSParser, RuleIndex, style, cascade_priority
+from src.render import DEFAULT_STYLE_SHEET, DocumentLayout, paint_tree, \
+    HEIGHT, PREFETCH, SCROLL_STEP
+from src.utils import DisplayList, DisplayListIndex, tree_to_list, \
+    set_backend
+from benchmarks.bench_parse import synthetic_document
+from benchmarks.bench_style import synthetic_stylesheet, table_document
+
+CORPUS_DIR = Path(__file__).resolve().parent / "corpus"
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+LINK = re.compile(r'<link rel="?stylesheet"? href="?([^" >]+)"?>')
+STAGES = ["parse", "css", "style", "layout", "paint", "cull"]
+# What each stage's throughput counts.
+UNITS = {"parse": "bytes", "css": "bytes", "style": "nodes",
+         "layout": "nodes", "paint": "commands", "cull": "steps"}
+
+
+def nested_document(depth=150, copies=20):
+    """
+    Sections nested depth deep, each level with a line of text.
+    """
+    out = ["<html><body>"]
+    for copy in range(copies):
+        for level in range(depth):
+            out.append("<div><span>level {} of copy {}</span> ".format(
+                level, copy))
+        out.append("<p>innermost <b>text</b></p>")
+        out.append("</div>" * depth)
+    out.append("</body></html>")
+    return "".join(out)
+
+
+def wide_document(siblings=20000):
+    """
+    One body with many short sibling blocks.
+    """
+    out = ["<html><body>"]
+    for i in range(siblings):
+        out.append("<div>item <i>{}</i></div>".format(i))
+    out.append("</body></html>")
+    return "".join(out)
+
+
+def corpus():
+    """
+    {name: (html, [css, ...])} for the fixture files and generated pages.
+    """
+    pages = {}
+    for path in sorted(CORPUS_DIR.glob("*.html")):
+        html = path.read_text(encoding="utf8")
+        sheets = [(CORPUS_DIR / href).read_text(encoding="utf8")
+                  for href in LINK.findall(html)]
+        pages[path.stem] = (html, sheets)
+    pages["large"] = (synthetic_document(3000), [synthetic_stylesheet(300)])
+    pages["nested"] = (nested_document(), [synthetic_stylesheet(100)])
+    pages["wide"] = (wide_document(), [synthetic_stylesheet(100)])
+    pages["table"] = (table_document(1000), [synthetic_stylesheet(300)])
+    return pages
+
+
+def run_stages(html, sheets):
+    """
+    Runs the pipeline once, returning {stage: seconds} and the count
+    each stage's throughput is measured in.
+    """
+    times = {}
+    start = time.perf_counter()
+    nodes = HTMLParser(html).parse()
+    times["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rules = DEFAULT_STYLE_SHEET.copy()
+    for sheet in sheets:
+        rules.extend(CSSParser(sheet).parse())
+    index = RuleIndex(sorted(rules, key=cascade_priority))
+    times["css"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    style(nodes, index)
+    times["style"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    document = DocumentLayout(nodes)
+    document.layout()
+    times["layout"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    display_list = DisplayList()
+    paint_tree(document, display_list)
+    times["paint"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    steps = cull(display_list, document.height)
+    times["cull"] = time.perf_counter() - start
+
+    node_count = len(tree_to_list(nodes, []))
+    counts = {"parse": len(html.encode("utf8")),
+              "css": sum(len(sheet.encode("utf8")) for sheet in sheets),
+              "style": node_count, "layout": node_count,
+              "paint": len(display_list), "cull": steps}
+    return times, counts
+
+
+def cull(display_list, height):
+    """
+    What draw() does per scroll step down the page: find the commands in
+    the band around the viewport. Returns the number of steps.
+    """
+    display_index = DisplayListIndex(display_list)
+    steps = range(0, int(height) + 1, SCROLL_STEP)
+    for scroll in steps:
+        display_index.visible_indices(scroll - PREFETCH,
+                                      scroll + HEIGHT + PREFETCH)
+    return len(steps)
+
+
+def peak_memory(html, sheets):
+    """
+    Peak bytes traced during each stage of one run.
+    """
+    peaks = {}
+
+    def traced(stage, function, *args):
+        tracemalloc.start()
+        result = function(*args)
+        peaks[stage] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result
+
+    nodes = traced("parse", lambda: HTMLParser(html).parse())
+    rules = traced("css", lambda: DEFAULT_STYLE_SHEET + [
+        rule for sheet in sheets for rule in CSSParser(sheet).parse()])
+    index = RuleIndex(sorted(rules, key=cascade_priority))
+    traced("style", style, nodes, index)
+    document = DocumentLayout(nodes)
+    traced("layout", document.layout)
+    display_list = DisplayList()
+    traced("paint", paint_tree, document, display_list)
+    traced("cull", cull, display_list, document.height)
+    return peaks
+
+
+def benchmark(pages, repeat):
+    results = {}
+    for name, (html, sheets) in pages.items():
+        best = {}
+        for _ in range(repeat):
+            times, counts = run_stages(html, sheets)
+            for stage, seconds in times.items():
+                best[stage] = min(best.get(stage, seconds), seconds)
+        peaks = peak_memory(html, sheets)
+        results[name] = {stage: {
+            "seconds": best[stage],
+            UNITS[stage]: counts[stage],
+            "per_second": counts[stage] / best[stage] if best[stage] else 0,
+            "peak_bytes": peaks[stage],
+        } for stage in STAGES}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints each stage's time against the baseline; returns the stages
+    slower by more than threshold.
+    """
+    regressions = []
+    print("\n{:<10} {:<7} {:>10} {:>10} {:>8}".format(
+        "page", "stage", "baseline", "now", "change"))
+    for name, stages in results.items():
+        if name not in baseline: continue
+        for stage, result in stages.items():
+            if stage not in baseline[name]: continue
+            before = baseline[name][stage]["seconds"]
+            now = result["seconds"]
+            change = now / before - 1 if before else 0
+            flag = ""
+            if change > threshold:
+                regressions.append((name, stage, change))
+                flag = "  slower"
+            print("{:<10} {:<7} {:>8.2f}ms {:>8.2f}ms {:>+7.1%}{}".format(
+                name, stage, before * 1000, now * 1000, change, flag))
+    return regressions
+
+
+def report(results):
+    print("{:<10} {:<7} {:>10} {:>21} {:>10}".format(
+        "page", "stage", "time", "throughput", "peak"))
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            print("{:<10} {:<7} {:>8.2f}ms {:>10.0f} {:<10} {:>8.2f}MB".format(
+                name, stage, result["seconds"] * 1000, result["per_second"],
+                UNITS[stage] + "/s", result["peak_bytes"] / 1e6))
+
+
+def main(argv):
+    options = {"--repeat": "3", "--pages": "", "--output": "",
+               "--baseline": str(BASELINE), "--threshold": "0.1"}
+    for flag in options:
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    save = "--save-baseline" in argv
+
+    set_backend(HeadlessBackend())
+    pages = corpus()
+    if options["--pages"]:
+        wanted = options["--pages"].split(",")
+        pages = {name: page for name, page in pages.items()
+                 if name in wanted}
+    results = benchmark(pages, int(options["--repeat"]))
+    report(results)
+
+    output = {"python": platform.python_version(),
+              "machine": platform.machine(),
+              "repeat": int(options["--repeat"]),
+              "pages": results}
+    if options["--output"]:
+        with open(options["--output"], "w") as f:
+            json.dump(output, f, indent=2)
+    baseline_path = Path(options["--baseline"])
+    if save:
+        with open(baseline_path, "w") as f:
+            json.dump(output, f, indent=2)
+        print("\nbaseline saved to {}".format(baseline_path))
+        return 0
+    if not baseline_path.exists():
+        print("\nno baseline at {}; run with --save-baseline to record "
+              "one".format(baseline_path))
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)["pages"]
+    regressions = compare(results, baseline, float(options["--threshold"]))
+    if regressions:
+        print("\n{} stage(s) slower than the baseline by more than {:.0%}"
+              .format(len(regressions), float(options["--threshold"])))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,113 @@
+"""
+Local stand-in web server that trickles a page out slowly, for measuring
+how soon the first screen paints compared to the full load.
+
+Usage:
+    python3 -m benchmarks.trickle_server [file.html] [--port N]
+        [--chunk BYTES] [--delay SECONDS] [--gzip] [--chunked]
+"""
+import gzip
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TrickleHandler(BaseHTTPRequestHandler):
+    """
+    Sends the server's page in chunk-sized pieces with a pause between each.
+    Any path serves the same page; paths ending in .css get an empty sheet.
+    With server.compress the page is gzip-compressed for clients that accept
+    it, and with server.chunked it is sent over HTTP/1.1 with chunked
+    transfer-encoding, keeping the connection alive.
+    """
+    def do_GET(self):
+        if self.path.endswith(".css"):
+            body = b""
+            content_type = "text/css"
+        else:
+            body = self.server.body
+            content_type = "text/html; charset=utf-8"
+        gzipped = self.server.compress \
+            and "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            body = gzip.compress(body)
+        if self.server.chunked:
+            # Keep the connection open for the next request unless the
+            # client asked to close it
+            self.protocol_version = "HTTP/1.1"
+            self.close_connection = \
+                self.headers.get("Connection", "").lower() == "close"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        if self.server.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk, delay = self.server.chunk, self.server.delay
+        try:
+            for i in range(0, len(body), chunk):
+                piece = body[i:i + chunk]
+                if self.server.chunked:
+                    piece = b"%x\r\n%s\r\n" % (len(piece), piece)
+                self.wfile.write(piece)
+                self.wfile.flush()
+                self.server.bytes_sent += len(piece)
+                time.sleep(delay)
+            if self.server.chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up partway, as a timed-out fetch does
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(body, port=0, chunk=4096, delay=0.05, compress=False,
+          chunked=False):
+    """
+    Starts the server on a background thread, returns it. The bound port
+    is server.server_address[1], and server.bytes_sent counts body bytes
+    written to the wire.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), TrickleHandler)
+    server.body = body.encode("utf8") if isinstance(body, str) else body
+    server.chunk = chunk
+    server.delay = delay
+    server.compress = compress
+    server.chunked = chunked
+    server.bytes_sent = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv):
+    options = {"--port": "8000", "--chunk": "4096", "--delay": "0.05"}
+    for flag in options:
+        if flag in argv:
+            i = argv.index(flag)
+            options[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    files = [arg for arg in argv if not arg.startswith("--")]
+    if files:
+        with open(files[0], "rb") as f:
+            body = f.read()
+    else:
+        from benchmarks.bench_parse import synthetic_document
+        body = synthetic_document()
+    server = serve(body, int(options["--port"]), int(options["--chunk"]),
+                   float(options["--delay"]), compress="--gzip" in argv,
+                   chunked="--chunked" in argv)
+    print("serving on http://127.0.0.1:{}/".format(server.server_address[1]))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
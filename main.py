@@ -1,5 +1,41 @@
+from pathlib import Path
+from src import trace
 from src.render import start
 
 if __name__ == "__main__":
-    import sys
-    start(sys.argv[1])
+    import argparse
+    parser = argparse.ArgumentParser(description="Chromatic web browser")
+    parser.add_argument("url", help="http, https or file URL, or a local "
+                                    "file path")
+    parser.add_argument("--timings", action="store_true",
+                        help="print per-resource load timings")
+    parser.add_argument("--headless", action="store_true",
+                        help="render without a window")
+    parser.add_argument("--commands", metavar="FILE",
+                        help="with --headless, save the drawn canvas items "
+                             "as JSON lines")
+    parser.add_argument("--image", metavar="FILE",
+                        help="with --headless, save the viewport as a PPM "
+                             "image")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="fetch the page and its stylesheets on an "
+                             "asyncio event loop")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="draw pages rendered before from a saved "
+                             "snapshot while they load, and save new ones")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record a Chrome trace of the load (and, with "
+                             "a window, everything until it is closed)")
+    args = parser.parse_args()
+    if (args.commands or args.image) and not args.headless:
+        parser.error("--commands and --image need --headless")
+    url = args.url
+    if "://" not in url:
+        url = Path(url).resolve().as_uri()
+    if args.trace:
+        trace.enable()
+    start(url, timings=args.timings, headless=args.headless,
+          commands=args.commands, image=args.image,
+          use_async=args.use_async, snapshots=args.snapshots)
+    if args.trace:
+        trace.export(args.trace)
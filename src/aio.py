@@ -0,0 +1,225 @@
+import asyncio
+import time
+from src.browse import ContentDecoder, body_framing, read_file, ssl_context
+from src.trace import span
+
+# Requests in flight at once to one server, as browsers allow.
+MAX_PER_HOST = 6
+# Seconds a whole exchange (connect, request, response) may take.
+TIMEOUT = 30.0
+
+
+class AsyncConnection:
+    """
+    An asyncio stream pair to one server.
+    """
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+
+    def close(self):
+        self.writer.close()
+
+class AsyncFetcher:
+    """
+    The asyncio counterpart of URL.request with a ConnectionPool: takes
+    the same URL objects, speaks HTTP/1.1 with keep-alive over asyncio
+    streams (TLS for https), and consults the same HTTPCache. At most
+    max_per_host requests run at once per server; the rest wait their
+    turn. Every exchange is bounded by timeout seconds, after which it
+    raises asyncio.TimeoutError.
+
+    A fetcher belongs to the event loop it is first used on.
+    """
+    def __init__(self, max_per_host=MAX_PER_HOST, timeout=TIMEOUT,
+                 cache=None, max_idle_per_host=None, idle_timeout=30.0):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.cache = cache
+        # By default every connection a host may use is kept for reuse
+        self.max_idle_per_host = max_per_host if max_idle_per_host is None \
+            else max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.limits = {}
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+
+    async def request(self, url):
+        """
+        Returns the page source at url, with bytes that aren't UTF-8
+        replaced as URL.stream does.
+        """
+        with span("AsyncFetcher.request", url=str(url)):
+            body = await self.fetch(url)
+        return body.decode("utf8", errors="replace")
+
+    async def fetch(self, url):
+        """
+        Returns the response body bytes at url, with chunked and
+        gzip/deflate encodings undone. Fresh cached responses skip the
+        network; stale ones are revalidated. File URLs are read from
+        disk on a worker thread.
+        """
+        if url.scheme == "file":
+            return await asyncio.to_thread(
+                lambda: b"".join(read_file(url.file_path())))
+        cache = self.cache
+        entry = None
+        if cache is not None:
+            key = str(url)
+            entry = cache.lookup(key)
+            if entry is not None and entry.is_fresh():
+                cache.hits += 1
+                return entry.body
+            cache.misses += 1
+        request_headers = entry.validators() if entry is not None else {}
+
+        async with self.limit(url):
+            status, headers, body, complete = await asyncio.wait_for(
+                self.exchange(url, request_headers), self.timeout)
+
+        if entry is not None and status == "304":
+            cache.revalidated += 1
+            cache.refresh(key, entry, headers)
+            return entry.body
+        if cache is not None and status == "200" and complete:
+            cache.store(key, headers, body)
+        return body
+
+    def limit(self, url):
+        key = (url.scheme, url.host, url.port)
+        semaphore = self.limits.get(key)
+        if semaphore is None:
+            semaphore = self.limits[key] = asyncio.Semaphore(
+                self.max_per_host)
+        return semaphore
+
+    async def exchange(self, url, request_headers):
+        """
+        One request and response on a pooled or new connection. Returns
+        status, headers, body and whether the body arrived in full.
+        """
+        conn, reused = await self.acquire(url)
+        try:
+            version, status, headers = \
+                await self.send(conn, url, request_headers)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            conn.close()
+            if not reused: raise
+            # Server closed the idle connection, retry on a fresh one
+            conn = await self.connect(url)
+            version, status, headers = \
+                await self.send(conn, url, request_headers)
+
+        complete = False
+        framing = None
+        try:
+            framing = body_framing(status, headers)
+            body, complete = await read_body_async(
+                conn.reader, framing, headers.get("content-length"))
+            encoding = headers.get("content-encoding", "identity").casefold()
+            if encoding != "identity":
+                decoder = ContentDecoder(encoding)
+                body = decoder.decompress(body) + decoder.flush()
+        finally:
+            reusable = complete and framing != "close" \
+                and version == "HTTP/1.1" \
+                and headers.get("connection", "").casefold() != "close"
+            if reusable:
+                self.release(conn)
+            else:
+                conn.close()
+        return status, headers, body, complete
+
+    async def send(self, conn, url, request_headers):
+        """
+        Writes the request, reads back the status line and headers.
+        """
+        conn.writer.write(url.request_bytes(True, request_headers))
+        await conn.writer.drain()
+
+        statusline = (await conn.reader.readline()).decode("utf8")
+        if not statusline:
+            raise ConnectionResetError("connection closed")
+        version, status, explanation = statusline.split(" ", 2)
+
+        headers = {}
+        while True:
+            line = (await conn.reader.readline()).decode("utf8")
+            if line in ["\r\n", "\n", ""]:
+                break
+            header, value = line.split(":", 1)
+            headers[header.casefold()] = value.strip()
+        return version, status, headers
+
+    async def acquire(self, url):
+        key = (url.scheme, url.host, url.port)
+        now = time.monotonic()
+        conns = self.idle.get(key, [])
+        while conns:
+            conn = conns.pop()
+            if now - conn.last_used < self.idle_timeout \
+                and not conn.reader.at_eof():
+                self.reused += 1
+                return conn, True
+            conn.close()
+        return await self.connect(url), False
+
+    async def connect(self, url):
+        self.opened += 1
+        tls = ssl_context() if url.scheme == "https" else None
+        reader, writer = await asyncio.open_connection(
+            url.host, url.port, ssl=tls,
+            server_hostname=url.host if tls else None)
+        return AsyncConnection((url.scheme, url.host, url.port),
+                               reader, writer)
+
+    def release(self, conn):
+        conn.last_used = time.monotonic()
+        conns = self.idle.setdefault(conn.key, [])
+        if len(conns) < self.max_idle_per_host:
+            conns.append(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        for conns in self.idle.values():
+            for conn in conns:
+                conn.close()
+        self.idle = {}
+
+async def read_body_async(reader, framing, length=None):
+    """
+    Reads a whole response body as read_body frames it. Returns the
+    bytes and whether the whole body arrived.
+    """
+    if framing == "empty":
+        return b"", True
+    if framing == "close":
+        return await reader.read(), True
+    parts = []
+    try:
+        if framing == "length":
+            return await reader.readexactly(int(length)), True
+
+        # Chunked: a hex size line before each chunk, a zero size at the end
+        while True:
+            line = await reader.readline()
+            if not line:
+                return b"".join(parts), False
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            parts.append(await reader.readexactly(size))
+            await reader.readline()
+        # Trailer headers run until a blank line
+        while True:
+            line = await reader.readline()
+            if line in [b"\r\n", b"\n", b""]:
+                return b"".join(parts), line != b""
+    except asyncio.IncompleteReadError as e:
+        parts.append(e.partial)
+        return b"".join(parts), False
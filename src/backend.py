@@ -0,0 +1,287 @@
+import heapq
+import json
+import math
+import time
+
+# Deterministic headless metrics, as fractions of the pixel size.
+ASCENT = 0.9
+DESCENT = 0.25
+ADVANCE = 0.55
+BOLD_ADVANCE = 0.6
+
+NAMED_COLORS = {
+    "black": (0, 0, 0), "silver": (192, 192, 192), "gray": (128, 128, 128),
+    "grey": (128, 128, 128), "white": (255, 255, 255),
+    "maroon": (128, 0, 0), "red": (255, 0, 0), "purple": (128, 0, 128),
+    "fuchsia": (255, 0, 255), "green": (0, 128, 0), "lime": (0, 255, 0),
+    "olive": (128, 128, 0), "yellow": (255, 255, 0), "navy": (0, 0, 128),
+    "blue": (0, 0, 255), "teal": (0, 128, 128), "aqua": (0, 255, 255),
+    "orange": (255, 165, 0), "brown": (165, 42, 42), "pink": (255, 192, 203),
+    "lightgray": (211, 211, 211), "lightgrey": (211, 211, 211),
+    "lightblue": (173, 216, 230), "lightgreen": (144, 238, 144),
+    "lightyellow": (255, 255, 224), "darkgray": (169, 169, 169),
+    "darkgrey": (169, 169, 169), "darkblue": (0, 0, 139),
+    "darkred": (139, 0, 0), "darkgreen": (0, 100, 0),
+}
+
+
+class TkBackend:
+    """
+    Fonts measured by Tk and drawing onto a Tk canvas in a real window.
+    tkinter is only imported once this backend is used.
+    """
+    def create_font(self, size, weight, style):
+        import tkinter
+        import tkinter.font
+        font = tkinter.font.Font(
+            size=size,
+            weight=weight,
+            slant=style
+            )
+        # Keeps the font alive; impactful for Windows and Linux
+        font.label = tkinter.Label(font=font)
+        return font
+
+    def create_window(self, title):
+        import tkinter
+        window = tkinter.Tk()
+        window.title(title)
+        return window
+
+    def create_canvas(self, window, width, height):
+        import tkinter
+        canvas = tkinter.Canvas(
+            window,
+            width=width,
+            height=height,
+            scrollregion=(0, 0, width, height),
+            bg="white"
+        )
+        canvas.pack(fill="both", expand=True)
+        return canvas
+
+    def create_scrollbar(self, window, command):
+        from tkinter import ttk
+        scrollbar = ttk.Scrollbar(window,
+                                  orient="vertical",
+                                  command = command)
+        scrollbar.place(relx = 1, rely = 0, relheight = 1, anchor = "ne")
+        return scrollbar
+
+class HeadlessBackend:
+    """
+    Runs the whole pipeline without a display: fonts have deterministic
+    metrics and drawing goes to a RecordingCanvas, which can be saved as
+    a command stream or a PPM image.
+    """
+    def create_font(self, size, weight, style):
+        return HeadlessFont(size, weight, style)
+
+    def create_window(self, title):
+        return HeadlessWindow(title)
+
+    def create_canvas(self, window, width, height):
+        return RecordingCanvas(width, height)
+
+    def create_scrollbar(self, window, command):
+        return HeadlessScrollbar()
+
+class HeadlessFont:
+    """
+    Stand-in for tkinter.font.Font: every character is the same width,
+    so measurements only depend on size, weight and length.
+    """
+    def __init__(self, size, weight, style):
+        self.size = size
+        self.weight = weight
+        self.style = style
+        px = size * 4 / 3 # Points to pixels
+        self.ascent = math.ceil(px * ASCENT)
+        self.descent = math.ceil(px * DESCENT)
+        advance = BOLD_ADVANCE if weight == "bold" else ADVANCE
+        self.advance = max(1, round(px * advance))
+
+    def measure(self, text):
+        return len(text) * self.advance
+
+    def metrics(self, name=None):
+        metrics = {
+            "ascent": self.ascent,
+            "descent": self.descent,
+            "linespace": self.ascent + self.descent,
+            "fixed": 1,
+        }
+        return metrics if name is None else metrics[name]
+
+    def __repr__(self):
+        return "HeadlessFont({}, {}, {})".format(
+            self.size, self.weight, self.style)
+
+class HeadlessWindow:
+    """
+    Stand-in for the Tk window. Callbacks scheduled with after() and
+    after_idle() run once due, in order: update() runs those due now,
+    and mainloop() waits for the rest until none are left.
+    """
+    def __init__(self, title):
+        self.title_text = title
+        self.pending = [] # Heap of (due, order, callback, args)
+        self.scheduled = 0
+
+    def title(self, text):
+        self.title_text = text
+
+    def bind(self, sequence, handler):
+        pass
+
+    def after(self, ms, callback, *args):
+        self.scheduled += 1
+        heapq.heappush(self.pending, (time.perf_counter() + ms / 1000,
+                                      self.scheduled, callback, args))
+        return self.scheduled
+
+    def after_idle(self, callback, *args):
+        return self.after(0, callback, *args)
+
+    def update(self):
+        while self.pending and self.pending[0][0] <= time.perf_counter():
+            due, order, callback, args = heapq.heappop(self.pending)
+            callback(*args)
+
+    def update_idletasks(self):
+        pass
+
+    def mainloop(self):
+        while self.pending:
+            wait = self.pending[0][0] - time.perf_counter()
+            if wait > 0: time.sleep(wait)
+            self.update()
+
+    def destroy(self):
+        self.pending = []
+
+class HeadlessScrollbar:
+    def set(self, first, last):
+        self.first, self.last = first, last
+
+class RecordingCanvas:
+    """
+    Stand-in for the Tk canvas that keeps its items, so what would be on
+    screen can be saved as JSON lines or rasterized to a PPM image.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.items = {}
+        self.next_id = 1
+        self.created = 0
+
+    def create_text(self, x, y, text="", font=None, fill="black", **options):
+        return self.add({"op": "text", "x": x, "y": y, "text": text,
+                         "font": [font.size, font.weight, font.style],
+                         "ascent": font.ascent, "advance": font.advance,
+                         "color": fill})
+
+    def create_rectangle(self, x1, y1, x2, y2, fill="", **options):
+        return self.add({"op": "rect", "x": x1, "y": y1, "x2": x2, "y2": y2,
+                         "color": fill})
+
+    def add(self, item):
+        item_id = self.next_id
+        self.next_id += 1
+        self.created += 1
+        self.items[item_id] = item
+        return item_id
+
+    def move(self, tag, dx, dy):
+        for item in self.items.values():
+            item["x"] += dx
+            item["y"] += dy
+            if item["op"] == "rect":
+                item["x2"] += dx
+                item["y2"] += dy
+
+    def coords(self, item_id, x1, y1, x2, y2):
+        item = self.items[item_id]
+        item["x"], item["y"] = x1, y1
+        if item["op"] == "rect":
+            item["x2"], item["y2"] = x2, y2
+
+    def delete(self, item_id):
+        if item_id == "all":
+            self.items = {}
+        else:
+            self.items.pop(item_id, None)
+
+    def config(self, **options):
+        pass
+
+    def winfo_height(self):
+        return self.height
+
+    def after(self, ms, callback, *args):
+        callback(*args)
+
+    def commands(self):
+        """
+        Items in stacking order, as plain dicts.
+        """
+        return [dict(item) for item in self.items.values()]
+
+    def save_commands(self, path):
+        with open(path, "w") as f:
+            for item in self.commands():
+                f.write(json.dumps(item) + "\n")
+
+    def save_ppm(self, path):
+        with open(path, "wb") as f:
+            f.write(self.rasterize())
+
+    def rasterize(self):
+        """
+        Returns a binary PPM of the visible canvas. Each non-space
+        character of text is drawn as a solid box the size of its cell.
+        """
+        width, height = self.width, self.height
+        pixels = bytearray(b"\xff" * (width * height * 3))
+
+        def fill(x1, y1, x2, y2, color):
+            x1, x2 = max(0, int(x1)), min(width, int(x2))
+            y1, y2 = max(0, int(y1)), min(height, int(y2))
+            if x1 >= x2: return
+            row = bytes(color) * (x2 - x1)
+            for y in range(y1, y2):
+                start = (y * width + x1) * 3
+                pixels[start:start + len(row)] = row
+
+        for item in self.items.values():
+            color = parse_color(item["color"])
+            if color is None: continue
+            if item["op"] == "rect":
+                fill(item["x"], item["y"], item["x2"], item["y2"], color)
+                continue
+            advance = item["advance"]
+            for i, c in enumerate(item["text"]):
+                if c.isspace(): continue
+                x = item["x"] + i * advance
+                fill(x + 1, item["y"] + 1, x + advance - 1,
+                     item["y"] + item["ascent"], color)
+
+        header = "P6\n{} {}\n255\n".format(width, height).encode("ascii")
+        return header + bytes(pixels)
+
+def parse_color(color):
+    """
+    RGB for a color name or #rgb/#rrggbb, black if unknown, None if empty.
+    """
+    if not color or color == "transparent": return None
+    color = color.casefold()
+    if color.startswith("#"):
+        digits = color[1:]
+        if len(digits) == 3:
+            digits = "".join(c * 2 for c in digits)
+        try:
+            return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+        except ValueError:
+            return (0, 0, 0)
+    return NAMED_COLORS.get(color, (0, 0, 0))
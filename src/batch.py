@@ -0,0 +1,150 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import time
+from pathlib import Path
+from src.backend import HeadlessBackend
+from src.browse import URL, HTMLParser, ConnectionPool, Text
+from src.cache import HTTPCache, CACHE_DIR
+from src.css import RuleIndex, style, cascade_priority
+from src.aio import AsyncFetcher
+from src.render import DEFAULT_STYLE_SHEET, DocumentLayout, \
+    paint_tree, stylesheet_links, fetch_stylesheet, fetch_page
+from src.utils import DisplayList, set_backend
+
+FORMATS = ["display", "layout"]
+
+# Set up once per worker process by init_worker, then reused for every
+# page that worker renders.
+WORKER = {}
+
+
+def init_worker(output, format):
+    """
+    Prepares a worker: headless fonts, a connection pool and HTTP cache of
+    its own, and the user-agent stylesheet already indexed.
+    """
+    set_backend(HeadlessBackend())
+    WORKER["output"] = Path(output)
+    WORKER["format"] = format
+    WORKER["pool"] = ConnectionPool()
+    WORKER["cache"] = HTTPCache(CACHE_DIR)
+    WORKER["default_index"] = RuleIndex(
+        sorted(DEFAULT_STYLE_SHEET, key=cascade_priority))
+
+def load(source):
+    """
+    Returns the parsed page at source, a URL or a local file, and a
+    function that loads the rules of one of its stylesheet links. Local
+    files are streamed into the parser from a memory map; a web page's
+    stylesheets are fetched up front, concurrently.
+    """
+    pool, cache = WORKER["pool"], WORKER["cache"]
+    if "://" not in source:
+        source = Path(source).resolve().as_uri()
+    url = URL(source)
+    if url.scheme == "file":
+        parser = HTMLParser()
+        for chunk in url.stream():
+            parser.feed(chunk)
+        return parser.close(), \
+            lambda link: fetch_stylesheet(url, link, pool, cache)[0]
+    nodes, stylesheets = asyncio.run(
+        fetch_page(url, AsyncFetcher(cache=cache)))
+    return nodes, stylesheets.get
+
+def render_page(job):
+    """
+    Fetches, parses, styles, lays out and paints one page, writes its
+    display list or layout tree to the output directory, and returns a
+    summary of how it went.
+    """
+    i, source = job
+    start = time.perf_counter()
+    summary = {"source": source, "ok": False}
+    try:
+        nodes, stylesheet = load(source)
+        links = stylesheet_links(nodes)
+        if links:
+            rules = DEFAULT_STYLE_SHEET.copy()
+            for link in links:
+                rules.extend(stylesheet(link))
+            index = RuleIndex(sorted(rules, key=cascade_priority))
+        else:
+            index = WORKER["default_index"]
+        style(nodes, index)
+        document = DocumentLayout(nodes)
+        document.layout()
+        display_list = DisplayList()
+        paint_tree(document, display_list)
+
+        name = "{:05d}-{}".format(i, re.sub(r"[^\w.-]+", "_", source)[-80:])
+        if WORKER["format"] == "display":
+            path = WORKER["output"] / (name + ".jsonl")
+            write_display_list(display_list, path)
+        else:
+            path = WORKER["output"] / (name + ".json")
+            with open(path, "w") as f:
+                json.dump(layout_summary(document), f)
+        summary.update(ok=True, output=path.name, height=document.height,
+                       commands=len(display_list))
+    except Exception as e:
+        summary["error"] = "{}: {}".format(type(e).__name__, e)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+def write_display_list(display_list, path):
+    """
+    One JSON object per paint command, in the format of
+    RecordingCanvas.save_commands, without the scroll offset.
+    """
+    with open(path, "w") as f:
+        for cmd in display_list:
+            if hasattr(cmd, "text"):
+                font = cmd.font
+                item = {"op": "text", "x": cmd.left, "y": cmd.top,
+                        "text": cmd.text,
+                        "font": [font.size, font.weight, font.style],
+                        "color": cmd.color}
+            else:
+                item = {"op": "rect", "x": cmd.left, "y": cmd.top,
+                        "x2": cmd.right, "y2": cmd.bottom, "color": cmd.color}
+            f.write(json.dumps(item) + "\n")
+
+def layout_summary(layout_object):
+    """
+    The layout tree as nested dicts: each box's node and geometry.
+    """
+    node = layout_object.node
+    return {
+        "node": "#text" if isinstance(node, Text) else node.tag,
+        "x": layout_object.x, "y": layout_object.y,
+        "width": layout_object.width, "height": layout_object.height,
+        "children": [layout_summary(child)
+                     for child in layout_object.children],
+    }
+
+def run(sources, output, workers=None, format="display"):
+    """
+    Renders every source into output using a pool of worker processes,
+    one per core by default. Returns the page summaries in source order,
+    which are also written to output/summary.json.
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    jobs = list(enumerate(sources))
+    if workers == 1:
+        init_worker(output, format)
+        summaries = [render_page(job) for job in jobs]
+    else:
+        # Small chunks keep workers busy when page sizes vary a lot
+        chunksize = max(1, len(jobs) // (workers * 8))
+        with multiprocessing.Pool(workers, init_worker,
+                                  (output, format)) as pool:
+            summaries = pool.map(render_page, jobs, chunksize)
+    with open(output / "summary.json", "w") as f:
+        json.dump(summaries, f, indent=2)
+    return summaries
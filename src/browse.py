@@ -1,12 +1,35 @@
+import codecs
+import mmap
+import os
+import re
 import socket
 import ssl
+import sys
+import threading
+import time
+import zlib
+from src.trace import span, traced
+
+# Most bytes read from the socket at once while streaming a response.
+CHUNK_SIZE = 16384
+SSL_CONTEXT = None
+
+# Every "<" and ">" in a document; the parser only does work at these.
+TAG_BOUNDARY = re.compile(r"[<>]")
 
 
 class URL:
     def __init__(self, url):
         # Separate url and scheme
         self.scheme, url = url.split("://", 1)
-        assert self.scheme in ["http", "https"]
+        assert self.scheme in ["http", "https", "file"]
+
+        # Local file: an optional host, then an absolute path
+        if self.scheme == "file":
+            self.host, url = url.split("/", 1) if "/" in url else (url, "")
+            self.port = None
+            self.path = "/" + url
+            return
 
         # Appropriate port
         if self.scheme == "http":
@@ -25,54 +48,168 @@ class URL:
             self.host, port = self.host.split(":", 1)
             self.port = int(port)
 
-    def request(self):
+    def request(self, pool=None, cache=None):
         """
         Handles all logic of communicating to server to obtain connection,
         returns page source code.
         """
+        with span("URL.request", url=str(self)):
+            return "".join(self.stream(pool=pool, cache=cache))
 
-        # Instantiate socket for communication
-        s = socket.socket(
-            family=socket.AF_INET, # Address Family
-            type=socket.SOCK_STREAM, # Send arbitrary amt of data
-            proto=socket.IPPROTO_TCP # Protocol
-        )
+    def stream(self, chunk_size=CHUNK_SIZE, pool=None, cache=None):
+        """
+        Same exchange as request(), but yields the page source in decoded
+        chunks as they arrive instead of waiting for the whole body.
+        """
+        # The body is decoded incrementally so a multi-byte character
+        # split across two reads is still decoded correctly; bytes that
+        # aren't UTF-8 become U+FFFD rather than failing the page
+        decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+        for data in self.fetch(chunk_size, pool, cache):
+            text = decoder.decode(data)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
 
-        s.connect((self.host, self.port))
+    def fetch(self, chunk_size=CHUNK_SIZE, pool=None, cache=None):
+        """
+        Sends the request and yields the response body bytes as they
+        arrive, with chunked and gzip/deflate encodings undone. Without a
+        pool this is a one-off HTTP/1.0 exchange. With one it is HTTP/1.1
+        over a persistent connection, which goes back to the pool once
+        the whole body has been read.
 
-        if self.scheme == "https":
-            ctx = ssl.create_default_context()
-            s = ctx.wrap_socket(s, server_hostname=self.host)
+        With a cache, fresh responses are served without touching the
+        network and stale ones are revalidated with a conditional request.
 
-        req = "GET {} HTTP/1.0\r\n".format(self.path)
-        req += "Host: {}\r\n".format(self.host)
-        req += "\r\n"
-        
-        s.send(req.encode("utf8"))
+        A file URL is read straight from disk, bypassing pool and cache.
+        """
+        if self.scheme == "file":
+            yield from read_file(self.file_path(), chunk_size)
+            return
 
-        # Parses server response from bytes into string via utf8 encoding
-        response = s.makefile("r", encoding="utf8", newline="\r\n")
+        entry = None
+        if cache is not None:
+            key = str(self)
+            entry = cache.lookup(key)
+            if entry is not None and entry.is_fresh():
+                cache.hits += 1
+                yield from chunks(entry.body, chunk_size)
+                return
+            cache.misses += 1
+        request_headers = entry.validators() if entry is not None else {}
 
-        statusline = response.readline()
+        keep_alive = pool is not None
+        if keep_alive:
+            conn, reused = pool.acquire(self)
+        else:
+            conn, reused = Connection(self.scheme, self.host, self.port), False
+
+        try:
+            version, status, response_headers = \
+                self.send(conn, keep_alive, request_headers)
+        except (OSError, ValueError):
+            conn.close()
+            if not reused: raise
+            # Server closed the idle connection, retry on a fresh one
+            conn = Connection(self.scheme, self.host, self.port)
+            version, status, response_headers = \
+                self.send(conn, keep_alive, request_headers)
+
+        complete = False
+        framing = None
+        body = [] if cache is not None and status == "200" else None
+        try:
+            framing = body_framing(status, response_headers)
+            encoding = response_headers.get(
+                "content-encoding", "identity").casefold()
+            decoder = ContentDecoder(encoding) \
+                if encoding != "identity" else None
+
+            reader = read_body(conn.file, framing,
+                               response_headers.get("content-length"),
+                               chunk_size)
+            while True:
+                try:
+                    data = next(reader)
+                except StopIteration as end:
+                    complete = end.value
+                    break
+                if decoder: data = decoder.decompress(data)
+                if not data: continue
+                if body is not None: body.append(data)
+                yield data
+            if decoder and complete:
+                data = decoder.flush()
+                if data:
+                    if body is not None: body.append(data)
+                    yield data
+        finally:
+            reusable = keep_alive and complete and framing != "close" \
+                and version == "HTTP/1.1" \
+                and response_headers.get("connection", "").casefold() \
+                    != "close"
+            if reusable:
+                pool.release(conn)
+            else:
+                conn.close()
+
+        if entry is not None and status == "304":
+            cache.revalidated += 1
+            cache.refresh(key, entry, response_headers)
+            yield from chunks(entry.body, chunk_size)
+        elif body is not None and complete:
+            cache.store(key, response_headers, b"".join(body))
+
+    def send(self, conn, keep_alive=False, headers=None):
+        """
+        Writes the request to the connection, reads back the status line
+        and headers. Returns version, status and headers.
+        """
+        conn.socket.sendall(self.request_bytes(keep_alive, headers))
+
+        statusline = conn.file.readline().decode("utf8")
         version, status, explanation = statusline.split(" ", 2)
 
         # Parse headers
         response_headers = {}
         while True:
-            line = response.readline()
+            line = conn.file.readline().decode("utf8")
             if line == "\r\n":
                 break
             header, value = line.split(":", 1)
             response_headers[header.casefold()] = value.strip()
 
-        # Checks for unusual data
-        assert "transfer-encoding" not in response_headers
-        assert "content-encoding" not in response_headers
+        return version, status, response_headers
+
+    def request_bytes(self, keep_alive=False, headers=None):
+        """
+        The GET request for this URL, HTTP/1.1 if keep_alive, else 1.0.
+        """
+        version = "HTTP/1.1" if keep_alive else "HTTP/1.0"
+        req = "GET {} {}\r\n".format(self.path, version)
+        req += "Host: {}\r\n".format(self.host)
+        req += "Accept-Encoding: gzip, deflate\r\n"
+        for header, value in (headers or {}).items():
+            req += "{}: {}\r\n".format(header, value)
+        req += "\r\n"
+        return req.encode("utf8")
 
-        content = response.read()
-        s.close()
+    def file_path(self):
+        """
+        The local path a file URL names, in the platform's form:
+        file:///C:/page.html is C:\\page.html on Windows.
+        """
+        from urllib.request import url2pathname # Slow to import
+        return url2pathname(self.path)
 
-        return content
+    def __str__(self):
+        if self.scheme == "file":
+            return "file://{}{}".format(self.host, self.path)
+        return "{}://{}:{}{}".format(self.scheme, self.host, self.port,
+                                     self.path)
 
     def resolve(self, url):
         if "://" in url: return URL(url)
@@ -85,34 +222,313 @@ class URL:
             url = dir + "/" + url
         if url.startswith("//"):
             return URL(self.scheme + ":" + url)
+        elif self.scheme == "file":
+            return URL("file://" + self.host + url)
         else:
             return URL(self.scheme + "://" + self.host \
                        + ":" + str(self.port) + url)
 
+class Connection:
+    """
+    A socket to one server, with a buffered binary reader over it.
+    """
+    def __init__(self, scheme, host, port):
+        self.key = (scheme, host, port)
+
+        # Instantiate socket for communication
+        s = socket.socket(
+            family=socket.AF_INET, # Address Family
+            type=socket.SOCK_STREAM, # Send arbitrary amt of data
+            proto=socket.IPPROTO_TCP # Protocol
+        )
+
+        s.connect((host, port))
+
+        if scheme == "https":
+            s = ssl_context().wrap_socket(s, server_hostname=host)
+
+        self.socket = s
+        self.file = s.makefile("rb")
+        self.last_used = time.monotonic()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+class ConnectionPool:
+    """
+    Keeps idle HTTP/1.1 connections open per (scheme, host, port), so
+    later requests to the same server skip TCP and TLS setup. Idle
+    connections are capped per server and overall, and dropped once they
+    have sat unused for idle_timeout seconds.
+    """
+    def __init__(self, max_idle_per_host=2, max_idle=8, idle_timeout=30.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def acquire(self, url):
+        """
+        Returns a connection for url and whether it was reused.
+        """
+        key = (url.scheme, url.host, url.port)
+        now = time.monotonic()
+        with self.lock:
+            conns = self.idle.get(key, [])
+            while conns:
+                conn = conns.pop()
+                if now - conn.last_used < self.idle_timeout:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+            self.opened += 1
+        return Connection(*key), False
+
+    def release(self, conn):
+        """
+        Takes back a connection whose last response was read in full.
+        """
+        conn.last_used = time.monotonic()
+        with self.lock:
+            conns = self.idle.setdefault(conn.key, [])
+            total = sum(len(idle) for idle in self.idle.values())
+            if len(conns) < self.max_idle_per_host and total < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+def read_file(path, chunk_size=CHUNK_SIZE):
+    """
+    Yields a local file's bytes chunk_size at a time. The file is memory
+    mapped rather than read, so only the pages being decoded need to be
+    in memory at once.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0: return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for i in range(0, len(data), chunk_size):
+                yield data[i:i + chunk_size]
+
+def body_framing(status, headers):
+    """
+    How the end of a response body is marked: "empty", "chunked",
+    "length", or "close" when it runs until the server hangs up.
+    """
+    if status in ["204", "304"] or status.startswith("1"):
+        return "empty"
+    if "transfer-encoding" in headers:
+        # Checks for unusual data
+        assert headers["transfer-encoding"].casefold() == "chunked"
+        return "chunked"
+    if "content-length" in headers:
+        return "length"
+    return "close"
+
+def read_body(file, framing, length=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields a response body in binary reads of up to chunk_size bytes as it
+    comes off the wire, undoing chunked transfer-encoding. Returns whether
+    the whole body arrived.
+    """
+    if framing == "empty":
+        return True
+    if framing == "close":
+        while True:
+            data = file.read1(chunk_size)
+            if not data:
+                return True
+            yield data
+    if framing == "length":
+        return (yield from read_exactly(file, int(length), chunk_size))
+
+    # Chunked: a hex size line before each chunk, a zero size at the end
+    while True:
+        line = file.readline()
+        if not line:
+            return False
+        size = int(line.split(b";", 1)[0], 16)
+        if size == 0:
+            break
+        if not (yield from read_exactly(file, size, chunk_size)):
+            return False
+        file.readline()
+    # Trailer headers run until a blank line
+    while True:
+        line = file.readline()
+        if line in [b"\r\n", b"\n", b""]:
+            return line != b""
+
+def read_exactly(file, size, chunk_size=CHUNK_SIZE):
+    remaining = size
+    while remaining:
+        data = file.read1(min(chunk_size, remaining))
+        if not data:
+            return False
+        remaining -= len(data)
+        yield data
+    return True
+
+class ContentDecoder:
+    """
+    Streaming decompressor for a gzip or deflate Content-Encoding.
+    """
+    def __init__(self, encoding):
+        # Checks for unusual data
+        assert encoding in ["gzip", "x-gzip", "deflate"]
+        self.encoding = encoding
+        self.zlib = None
+
+    def decompress(self, data):
+        if self.zlib is None:
+            if self.encoding == "deflate" and not is_zlib_header(data):
+                # Some servers send raw deflate data without the wrapper
+                wbits = -zlib.MAX_WBITS
+            elif self.encoding == "deflate":
+                wbits = zlib.MAX_WBITS
+            else:
+                wbits = 16 + zlib.MAX_WBITS
+            self.zlib = zlib.decompressobj(wbits)
+        return self.zlib.decompress(data)
+
+    def flush(self):
+        return self.zlib.flush() if self.zlib else b""
+
+def is_zlib_header(data):
+    return len(data) >= 2 and data[0] & 0x0f == 8 \
+        and (data[0] * 256 + data[1]) % 31 == 0
+
+def chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+def ssl_context():
+    """
+    Shared TLS context, so CA certificates are only loaded once.
+    """
+    global SSL_CONTEXT
+    if SSL_CONTEXT is None:
+        SSL_CONTEXT = ssl.create_default_context()
+    return SSL_CONTEXT
+
 class Text:
+    __slots__ = ("text", "children", "parent", "style", "needs_style",
+                 "child_needs_style", "needs_layout", "child_needs_layout")
+
     def __init__(self, text, parent):
         self.text = text
         self.children = []
         self.parent = parent
 
+        # Dirty bits: whether this node, or something below it, needs
+        # restyling or relaying out since the last pass
+        self.needs_style = True
+        self.child_needs_style = False
+        self.needs_layout = True
+        self.child_needs_layout = False
+
+    def set_text(self, text):
+        self.text = text
+        mark_layout_dirty(self)
+
     def __repr__(self):
         return repr(self.text)
 
 class Element:
+    __slots__ = ("tag", "attributes", "children", "parent", "style",
+                 "needs_style", "child_needs_style", "needs_layout",
+                 "child_needs_layout")
+
     def __init__(self, tag, attributes, parent):
         self.tag = tag
         self.attributes = attributes
         self.children = []
         self.parent = parent
 
+        # Dirty bits, as on Text
+        self.needs_style = True
+        self.child_needs_style = False
+        self.needs_layout = True
+        self.child_needs_layout = False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+        mark_style_dirty(self)
+
+    def remove_attribute(self, key):
+        if self.attributes.pop(key, None) is not None:
+            mark_style_dirty(self)
+
+    def insert_child(self, child, index=None):
+        """
+        Adds child (a new node or subtree) at index, by default last.
+        """
+        child.parent = self
+        if index is None:
+            self.children.append(child)
+        else:
+            self.children.insert(index, child)
+        mark_style_dirty(child)
+        mark_layout_dirty(self)
+
+    def remove_child(self, child):
+        self.children.remove(child)
+        child.parent = None
+        mark_layout_dirty(self)
+
     def __repr__(self):
         return "<" + self.tag + ">"
 
+def mark_style_dirty(node):
+    """
+    Flags node's subtree for restyling and its ancestors as having a dirty
+    descendant, stopping at the first one already flagged.
+    """
+    node.needs_style = True
+    node = node.parent
+    while node and not node.child_needs_style:
+        node.child_needs_style = True
+        node = node.parent
+
+def mark_layout_dirty(node):
+    """
+    Flags node for relayout and its ancestors as having a dirty
+    descendant, stopping at the first one already flagged.
+    """
+    node.needs_layout = True
+    node = node.parent
+    while node and not node.child_needs_layout:
+        node.child_needs_layout = True
+        node = node.parent
+
+def copy_tree(node, parent=None):
+    """
+    An unstyled copy of the tree under node, sharing no nodes or
+    attribute dicts with it, so the copy can be handed to another thread
+    while the original is still being built.
+    """
+    if isinstance(node, Text):
+        return Text(node.text, parent)
+    copy = Element(node.tag, dict(node.attributes), parent)
+    copy.children = [copy_tree(child, copy) for child in node.children]
+    return copy
 
 class HTMLParser:
-    def __init__(self, body):
+    def __init__(self, body=""):
         self.body = body
         self.unfinished = []
+        self.buffer = ""
+        self.in_tag = False
         self.SELF_CLOSING_TAGS = [
             "area", "base", "br", "col", "embed", "hr", "img", "input",
             "link", "meta", "param", "source", "track", "wbr"
@@ -124,38 +540,69 @@ class HTMLParser:
 
     def get_attributes(self, text):
         """
-        Returns tag and attributes in text
+        Returns tag and attributes in text. Tag and attribute names are
+        interned, so the many nodes with the same tag share one string.
         """
         parts = text.split()
-        tag = parts[0].casefold()
+        tag = sys.intern(parts[0].casefold())
         attributes = {}
         for attrpair in parts[1:]:
             if "=" in attrpair:
                 key, value = attrpair.split("=", 1)
                 if len(value) > 2 and value[0] in ["'", "\""]:
                     value = value[1:-1]
-                attributes[key.casefold()] = value
+                attributes[sys.intern(key.casefold())] = value
             else:
-                attributes[attrpair.casefold()] = ""
+                attributes[sys.intern(attrpair.casefold())] = ""
         return tag, attributes
 
+    @traced("HTMLParser.parse")
     def parse(self):
-        text = ""
-        in_tag = False
-        for c in self.body:
-            if c == "<":
+        """
+        Parses the whole body at once.
+        """
+        self.feed(self.body)
+        return self.close()
+
+    def feed(self, data):
+        """
+        Parses another chunk of source. Jumps between tag boundaries,
+        slicing out text runs and tag contents rather than building them
+        one character at a time. Whatever follows the last boundary is
+        buffered, since the next chunk may continue that text or tag.
+        """
+        buffer = self.buffer + data if self.buffer else data
+        start = 0
+        in_tag = self.in_tag
+        for match in TAG_BOUNDARY.finditer(buffer):
+            end = match.start()
+            if buffer[end] == "<":
                 in_tag = True
-                if text: self.add_text(text)
-                text = ""
-            elif c == ">":
-                in_tag = False
-                self.add_tag(text)
-                text = ""
+                if end > start: self.add_text(buffer[start:end])
             else:
-                text += c
-        if not in_tag and text:
-            self.add_text(text)
+                in_tag = False
+                self.add_tag(buffer[start:end])
+            start = end + 1
+        self.buffer = buffer[start:]
+        self.in_tag = in_tag
+
+    def close(self):
+        """
+        Flushes trailing text once no more chunks will come, returns the
+        finished tree.
+        """
+        if not self.in_tag and self.buffer:
+            self.add_text(self.buffer)
+        self.buffer = ""
         return self.finish()
+
+    def partial_tree(self):
+        """
+        Returns the root of the tree parsed so far, or None before the
+        first node. Open elements are already attached to their parents,
+        so the result can be styled and laid out mid-download.
+        """
+        return self.unfinished[0] if self.unfinished else None
     
     def add_text(self, text):
         if text.isspace(): return
@@ -175,18 +622,18 @@ class HTMLParser:
             # Close tag finishes last unfinished node
             if len(self.unfinished) == 1: return 
             # Last tag edge case
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
+            self.unfinished.pop()
         elif tag in self.SELF_CLOSING_TAGS:
             parent = self.unfinished[-1]
             node = Element(tag, attributes, parent)
             parent.children.append(node)
         else:
-            # Open tag adds unfinished node to end of list
+            # Open tag adds unfinished node to end of list, attached to its
+            # parent straight away so partial trees are complete
             parent = self.unfinished[-1] if self.unfinished else None 
             # First tag edge case
             node = Element(tag, attributes, parent)
+            if parent: parent.children.append(node)
             self.unfinished.append(node)
 
     def finish(self):
@@ -196,13 +643,12 @@ class HTMLParser:
         """
         if not self.unfinished:
             self.implicit_tags(None)
-        while len(self.unfinished) > 1:
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
+        del self.unfinished[1:]
         return self.unfinished.pop()
 
     def implicit_tags(self, tag):
+        # Implicit tags only ever apply at the top two levels of the tree
+        if len(self.unfinished) > 2: return
         while True:
             open_tags = [node.tag for node in self.unfinished]
             if open_tags == [] and tag != "html":
@@ -246,7 +692,6 @@ def print_tree(node, indent=0):
         print_tree(child, indent + 2)
 
 if __name__ == "__main__":
-    import sys
     body = URL(sys.argv[1]).request()
     nodes = HTMLParser(body).parse()
     print_tree(nodes)
\ No newline at end of file
@@ -0,0 +1,490 @@
+import hashlib
+import json
+import marshal
+import os
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from src.css import CSSParser, DescendantSelector, TagSelector
+from src.utils import DisplayList, DisplayListIndex, FONTS, FONT_TABLE, \
+    COLOR_TABLE, get_font, font_id, color_id
+
+# Bytes of response bodies kept in memory before the least recently used
+# entries are dropped (they stay on disk).
+MAX_MEMORY_BYTES = 32 * 1024 * 1024
+CACHE_DIR = Path.home() / ".cache" / "chromatic" / "http"
+STYLESHEET_CACHE_DIR = Path.home() / ".cache" / "chromatic" / "css"
+# Parsed stylesheets kept in memory.
+MAX_STYLESHEETS = 256
+# Bump when CSSParser's output changes, so stale compiled sheets are ignored.
+STYLESHEET_FORMAT = 2
+SNAPSHOT_CACHE_DIR = Path.home() / ".cache" / "chromatic" / "snapshots"
+# Bytes of snapshots kept on disk before the least recently used go.
+MAX_SNAPSHOT_BYTES = 64 * 1024 * 1024
+# Bump when layout or paint output changes, so old snapshots are ignored.
+SNAPSHOT_FORMAT = 2
+
+
+def temp_path(path):
+    """
+    Where to write path's new contents before moving them into place,
+    unique to this process and thread: batch workers are forked, so
+    their thread idents are all the same.
+    """
+    return path.with_suffix(".{}.{}.tmp".format(os.getpid(),
+                                               threading.get_ident()))
+
+def parse_cache_control(value):
+    """
+    Splits a Cache-Control header into {directive: argument or None}.
+    """
+    directives = {}
+    for part in value.split(","):
+        part = part.strip()
+        if not part: continue
+        if "=" in part:
+            key, arg = part.split("=", 1)
+            directives[key.strip().casefold()] = arg.strip().strip('"')
+        else:
+            directives[part.casefold()] = None
+    return directives
+
+def parse_http_date(value):
+    """
+    Returns an HTTP date as seconds since the epoch, None if malformed.
+    """
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class CacheEntry:
+    """
+    A stored response: its headers, body bytes and when it was stored.
+    """
+    def __init__(self, headers, body, stored_at):
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+
+    def freshness_lifetime(self):
+        """
+        Seconds the response may be served without asking the server,
+        from max-age, then Expires, then 10% of the time since it was
+        last modified.
+        """
+        directives = parse_cache_control(self.headers.get("cache-control", ""))
+        if "max-age" in directives:
+            try:
+                return int(directives["max-age"])
+            except ValueError:
+                return 0
+        date = parse_http_date(self.headers.get("date", "")) \
+            or self.stored_at
+        if "expires" in self.headers:
+            expires = parse_http_date(self.headers["expires"])
+            return max(0, expires - date) if expires else 0
+        last_modified = parse_http_date(self.headers.get("last-modified", ""))
+        if last_modified:
+            return max(0, date - last_modified) / 10
+        return 0
+
+    def age(self, now):
+        try:
+            initial_age = int(self.headers.get("age", "0"))
+        except ValueError:
+            initial_age = 0
+        return initial_age + max(0, now - self.stored_at)
+
+    def is_fresh(self, now=None):
+        directives = parse_cache_control(self.headers.get("cache-control", ""))
+        if "no-cache" in directives: return False
+        if now is None: now = time.time()
+        return self.age(now) < self.freshness_lifetime()
+
+    def validators(self):
+        """
+        Request headers that make a conditional request for this entry.
+        """
+        headers = {}
+        if "etag" in self.headers:
+            headers["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+class HTTPCache:
+    """
+    Response cache under URL.request: an in-memory LRU bounded by body
+    bytes, backed by one file per URL in directory (if given) so entries
+    survive restarts.
+    """
+    def __init__(self, directory=None, max_bytes=MAX_MEMORY_BYTES):
+        self.directory = Path(directory) if directory else None
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def lookup(self, key):
+        """
+        Returns the stored entry for key, fresh or not, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+        entry = self.read(key)
+        if entry is not None:
+            self.remember(key, entry)
+        return entry
+
+    def store(self, key, headers, body):
+        """
+        Keeps a 200 response if its headers allow it and it could ever be
+        reused, either while fresh or through a validator.
+        """
+        directives = parse_cache_control(headers.get("cache-control", ""))
+        if "no-store" in directives or headers.get("vary") == "*":
+            return
+        entry = CacheEntry(headers, body, time.time())
+        if not entry.freshness_lifetime() and not entry.validators():
+            return
+        self.remember(key, entry)
+        self.write(key, entry)
+
+    def refresh(self, key, entry, headers):
+        """
+        Updates an entry after the server answered 304 Not Modified.
+        """
+        entry.headers.update(headers)
+        entry.stored_at = time.time()
+        self.write(key, entry)
+
+    def remember(self, key, entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            if len(entry.body) > self.max_bytes:
+                return
+            self.entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+    def path(self, key):
+        return self.directory / hashlib.sha256(key.encode("utf8")).hexdigest()
+
+    def read(self, key):
+        """
+        Loads an entry from disk: a JSON header line, then the body.
+        """
+        if self.directory is None: return None
+        try:
+            with open(self.path(key), "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("key") != key: return None
+        return CacheEntry(meta["headers"], body, meta["stored_at"])
+
+    def write(self, key, entry):
+        if self.directory is None: return
+        meta = {"key": key, "headers": entry.headers,
+                "stored_at": entry.stored_at}
+        path = self.path(key)
+        temp = temp_path(path)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(temp, "wb") as f:
+                f.write(json.dumps(meta).encode("utf8") + b"\n")
+                f.write(entry.body)
+            os.replace(temp, path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if self.directory is not None and self.directory.exists():
+            for path in self.directory.iterdir():
+                path.unlink()
+
+class StylesheetCache:
+    """
+    Parsed stylesheets keyed by a hash of their source, so a stylesheet
+    seen before (the user-agent sheet at startup, or a shared external
+    one) isn't reparsed. Rule lists are kept in memory and, if directory
+    is given, on disk as compact marshalled (tags, body) pairs, which
+    load much faster than reparsing and, unlike pickles, can't run code.
+    A changed source hashes differently, so stale entries are never used.
+    """
+    def __init__(self, directory=None, max_sheets=MAX_STYLESHEETS):
+        self.directory = Path(directory) if directory else None
+        self.max_sheets = max_sheets
+        self.sheets = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, text):
+        """
+        Returns the rules of stylesheet text, as CSSParser(text).parse()
+        would. The list is shared, so callers must not modify it.
+        """
+        key = hashlib.sha256("{}:{}".format(
+            STYLESHEET_FORMAT, text).encode("utf8")).hexdigest()
+        with self.lock:
+            rules = self.sheets.get(key)
+            if rules is not None:
+                self.sheets.move_to_end(key)
+                self.hits += 1
+                return rules
+        rules = self.read(key)
+        if rules is None:
+            self.misses += 1
+            rules = CSSParser(text).parse()
+            self.write(key, rules)
+        else:
+            self.hits += 1
+        with self.lock:
+            self.sheets[key] = rules
+            while len(self.sheets) > self.max_sheets:
+                self.sheets.popitem(last=False)
+        return rules
+
+    def read(self, key):
+        if self.directory is None: return None
+        try:
+            with open(self.directory / key, "rb") as f:
+                compiled = marshal.loads(f.read())
+            rules = [(build_selector(tags), dict(body))
+                     for tags, body in compiled]
+        except Exception:
+            # Unreadable, or not what write() stores: reparse instead
+            return None
+        return rules
+
+    def write(self, key, rules):
+        if self.directory is None: return
+        compiled = [(selector.tags, body) for selector, body in rules]
+        path = self.directory / key
+        temp = temp_path(path)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(temp, "wb") as f:
+                marshal.dump(compiled, f)
+            os.replace(temp, path)
+        except OSError:
+            pass
+
+def build_selector(tags):
+    """
+    Rebuilds a selector from its tags, as CSSParser.selector would.
+    """
+    out = TagSelector(tags[0])
+    for tag in tags[1:]:
+        out = DescendantSelector(out, TagSelector(tag))
+    return out
+
+def snapshot_key(source_hash, rules, width):
+    """
+    Identifies what a page renders to: a hash of its source, every rule
+    that applies to it (the user-agent sheet's included), and the width
+    it is laid out at.
+    """
+    digest = hashlib.sha256("{}:{}:{}:".format(
+        SNAPSHOT_FORMAT, width, source_hash).encode("utf8"))
+    digest.update(marshal.dumps([(selector.tags, body)
+                                for selector, body in rules]))
+    return digest.hexdigest()
+
+class Snapshot:
+    """
+    A rendered page: its display list with the list's index, the
+    document height, and the snapshot_key it was rendered from. As read,
+    the display list's fonts and colors index the snapshot's own tables
+    until resolve() is called.
+    """
+    def __init__(self, key, height, display_list, index, fonts, colors):
+        self.key = key
+        self.height = height
+        self.display_list = display_list
+        self.index = index
+        self.fonts = fonts
+        self.colors = colors
+
+    def resolve(self):
+        """
+        Points the display list at this process's FONT_TABLE and
+        COLOR_TABLE. Fonts are made by the backend, so this must run on
+        the window's thread. Only the first call does anything.
+        """
+        if self.fonts is None: return
+        display_list = self.display_list
+        fonts = [font_id(get_font(*key)) if key else 0 for key in self.fonts]
+        colors = [color_id(color) for color in self.colors]
+        display_list.fonts = array("I", [fonts[i] for i in display_list.fonts])
+        display_list.colors = array("I",
+                                    [colors[i] for i in display_list.colors])
+        self.fonts = self.colors = None
+
+class SnapshotStore:
+    """
+    Rendered pages on disk, one file per name (the page's URL, viewport
+    width and backend), so a page opened again can be drawn before it is
+    fetched. A file is a JSON line with the key, height and the fonts
+    and colors used, then the display list's columns and its index's
+    order, compressed with zlib. Once the files pass max_bytes, the
+    least recently used are deleted.
+    """
+    def __init__(self, directory=SNAPSHOT_CACHE_DIR,
+                 max_bytes=MAX_SNAPSHOT_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, name):
+        return self.directory / hashlib.sha256(
+            repr(name).encode("utf8")).hexdigest()
+
+    def lookup(self, name):
+        """
+        Returns the stored Snapshot for name, resolved, or None.
+        """
+        snapshot = self.read(name)
+        if snapshot is not None:
+            snapshot.resolve()
+        return snapshot
+
+    def read(self, name):
+        """
+        Returns the stored Snapshot for name, not yet resolved, or None.
+        Safe to call from a worker thread.
+        """
+        path = self.path(name)
+        try:
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                data = zlib.decompress(f.read())
+            if meta.get("name") != list(name) \
+                or meta.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError("not this snapshot")
+            display_list, index = decode_display_list(meta, data)
+            os.utime(path) # Recently used, for eviction
+        except (OSError, ValueError, KeyError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Snapshot(meta["key"], meta["height"], display_list, index,
+                        meta["fonts"], meta["colors"])
+
+    def store(self, name, key, height, display_list, index):
+        meta, data = encode_display_list(display_list, index)
+        meta.update(name=list(name), format=SNAPSHOT_FORMAT, key=key,
+                    height=height)
+        path = self.path(name)
+        temp = temp_path(path)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(temp, "wb") as f:
+                f.write(json.dumps(meta).encode("utf8") + b"\n")
+                f.write(zlib.compress(data, 1))
+            os.replace(temp, path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Deletes the least recently used snapshots until the rest fit.
+        """
+        files = []
+        for path in self.directory.iterdir():
+            stat = path.stat()
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes: break
+            path.unlink()
+            total -= size
+
+    def clear(self):
+        if self.directory.exists():
+            for path in self.directory.iterdir():
+                path.unlink()
+
+def encode_display_list(display_list, index):
+    """
+    A display list and its DisplayListIndex as metadata and bytes: the
+    coordinate, font and color columns, the index's sorted and tall
+    positions, then the texts joined by NUL, a rectangle's as "". Fonts and
+    colors are renumbered into tables of their own, since FONT_TABLE and
+    COLOR_TABLE indices only hold in this process.
+    """
+    font_keys = {id(font): key for key, font in FONTS.items()}
+    fonts, font_ids = [], {}
+    colors, color_ids = [], {}
+    for i in set(display_list.fonts):
+        font_ids[i] = len(fonts)
+        fonts.append(font_keys.get(id(FONT_TABLE[i])) if FONT_TABLE else None)
+    for i in set(display_list.colors):
+        color_ids[i] = len(colors)
+        colors.append(COLOR_TABLE[i])
+    font_column = array("I", [font_ids[i] for i in display_list.fonts])
+    color_column = array("I", [color_ids[i] for i in display_list.colors])
+    texts = "\0".join([text or "" for text in display_list.texts])
+    data = b"".join([display_list.lefts.tobytes(),
+                     display_list.tops.tobytes(),
+                     display_list.rights.tobytes(),
+                     display_list.bottoms.tobytes(),
+                     font_column.tobytes(), color_column.tobytes(),
+                     array("I", index.order).tobytes(),
+                     array("I", index.tall).tobytes(),
+                     texts.encode("utf8")])
+    meta = {"count": len(display_list), "fonts": fonts, "colors": colors,
+            "tall": len(index.tall), "max_height": index.max_height}
+    return meta, data
+
+def decode_display_list(meta, data):
+    """
+    The display list and index encode_display_list made meta and data
+    from, with fonts and colors still in the snapshot's own tables.
+    """
+    n, tall = meta["count"], meta["tall"]
+    display_list = DisplayList()
+    order, tall_order = array("I"), array("I")
+    offset = 0
+    for column, length in [(display_list.lefts, n), (display_list.tops, n),
+                           (display_list.rights, n),
+                           (display_list.bottoms, n),
+                           (display_list.fonts, n), (display_list.colors, n),
+                           (order, n - tall), (tall_order, tall)]:
+        size = length * column.itemsize
+        column.frombytes(data[offset:offset + size])
+        offset += size
+    if n:
+        texts = data[offset:].decode("utf8").split("\0")
+        display_list.texts = [text or None for text in texts]
+    if len(display_list.texts) != n:
+        raise ValueError("truncated snapshot")
+    if n and (max(display_list.fonts) >= len(meta["fonts"])
+              or max(display_list.colors) >= len(meta["colors"])):
+        raise ValueError("font or color out of range")
+    index = DisplayListIndex(display_list, (order.tolist(),
+                                            tall_order.tolist(),
+                                            meta["max_height"]))
+    return display_list, index
@@ -1,4 +1,7 @@
-from src.browse import Element
+import sys
+from types import MappingProxyType
+from src.browse import Element, mark_layout_dirty
+from src.trace import count, traced
 
 INHERITED_PROPERTIES = {
     "font-size": "16px",
@@ -7,6 +10,10 @@ INHERITED_PROPERTIES = {
     "color": "black",
 }
 
+# Ancestor Bloom filter size, as a power of two.
+BLOOM_BITS = 12
+BLOOM_MASK = (1 << BLOOM_BITS) - 1
+
 class CSSParser:
     def __init__(self, s):
         self.s = s
@@ -47,7 +54,9 @@ class CSSParser:
         self.literal(":")
         self.whitespace()
         val = self.word()
-        return prop.casefold(), val
+        # Interned, as the same few properties and values repeat across
+        # every rule and inline style
+        return sys.intern(prop.casefold()), sys.intern(val)
     
     def body(self):
         pairs = {}
@@ -113,7 +122,8 @@ class CSSParser:
         
 class TagSelector:
     def __init__(self, tag):
-        self.tag = tag.lower()
+        self.tag = sys.intern(tag.lower())
+        self.tags = [self.tag]
         self.priority = 1
     
     def matches(self, node):
@@ -123,6 +133,7 @@ class DescendantSelector:
     def __init__(self, ancestor, descendant):
         self.ancestor = ancestor
         self.descendant = descendant
+        self.tags = ancestor.tags + descendant.tags
         self.priority = ancestor.priority + descendant.priority
 
     def matches(self, node):
@@ -132,41 +143,182 @@ class DescendantSelector:
             node = node.parent
         return False
 
+class RuleIndex:
+    """
+    Sorted rules bucketed by the tag their selector's rightmost part
+    requires, so each node is only tested against rules that could match
+    it. Buckets keep the sorted order, so the cascade is unchanged.
+    """
+    def __init__(self, rules):
+        self.buckets = {}
+        for selector, body in rules:
+            # Every selector ends in a tag; the rest are ancestor tags
+            *ancestors, key = selector.tags
+            fingerprint = tuple(
+                i for tag in ancestors for i in bloom_hashes(tag))
+            self.buckets.setdefault(key, []).append(
+                (selector, body, fingerprint))
+
+    def candidates(self, node):
+        if not isinstance(node, Element): return ()
+        return self.buckets.get(node.tag, ())
+
+class AncestorFilter:
+    """
+    Counting Bloom filter over the tags of the current node's ancestors,
+    kept up to date while style() walks the tree, as in Blink. A
+    descendant selector needing an ancestor tag that isn't in the filter
+    can't match, which is found without walking parent links.
+    """
+    def __init__(self):
+        self.counts = [0] * (1 << BLOOM_BITS)
+
+    def push(self, node):
+        for i in bloom_hashes(node.tag):
+            self.counts[i] += 1
+
+    def pop(self, node):
+        for i in bloom_hashes(node.tag):
+            self.counts[i] -= 1
+
+    def may_match(self, fingerprint):
+        counts = self.counts
+        for i in fingerprint:
+            if not counts[i]: return False
+        return True
+
+def bloom_hashes(tag):
+    h = hash(tag)
+    return h & BLOOM_MASK, (h >> BLOOM_BITS) & BLOOM_MASK
+
+class StyleSharingCache:
+    """
+    Computed styles shared between nodes with identical inputs: the same
+    parent style object and the same tag, with no inline style. Such
+    nodes have the same ancestor tags, so the same rules match them and
+    they get one shared, read-only style instead of a fresh dict each.
+    """
+    def __init__(self):
+        self.styles = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, node):
+        if not node.parent: return None
+        if isinstance(node, Element):
+            if "style" in node.attributes: return None
+            return id(node.parent.style), node.tag
+        return id(node.parent.style), None
+
+    def get(self, key, parent_style):
+        shared = self.styles.get(key)
+        # Ids can be reused, so check the parent style is the same object
+        if shared and shared[0] is parent_style:
+            self.hits += 1
+            return shared[1]
+        self.misses += 1
+        return None
+
+    def put(self, key, parent_style, style):
+        self.styles[key] = (parent_style, style)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+@traced("style")
 def style(node, rules):
-    node.style = {}
+    """
+    Computes node.style for node and its subtree from rules, sorted by
+    cascade_priority. Returns the style-sharing cache, for its hit rate.
+    """
+    index = rules if isinstance(rules, RuleIndex) else RuleIndex(rules)
+    ancestors = AncestorFilter()
+    parent = node.parent
+    while parent:
+        ancestors.push(parent)
+        parent = parent.parent
+    shared = StyleSharingCache()
+    style_node(node, index, ancestors, shared)
+    return shared
+
+def restyle(node, rules):
+    """
+    Restyles only the subtrees marked dirty since the last pass, and marks
+    each restyled subtree, and every node in it whose style changed, for
+    relayout.
+    """
+    index = rules if isinstance(rules, RuleIndex) else RuleIndex(rules)
+    if node.needs_style:
+        style(node, index)
+        mark_layout_dirty(node)
+    elif node.child_needs_style:
+        node.child_needs_style = False
+        for child in node.children:
+            restyle(child, index)
+
+def style_node(node, index, ancestors, shared):
+    node.needs_style = node.child_needs_style = False
+    key = shared.key(node)
+    computed = None
+    if key:
+        computed = shared.get(key, node.parent.style)
+    if computed is None:
+        computed = MappingProxyType(compute_style(node, index, ancestors))
+        if key:
+            shared.put(key, node.parent.style, computed)
+    # On a restyle, boxes laid out with the old style are stale
+    old = getattr(node, "style", None)
+    if old is not None and old != computed:
+        mark_layout_dirty(node)
+    node.style = computed
+
+    # Recurse children
+    if node.children:
+        ancestors.push(node)
+        for child in node.children:
+            style_node(child, index, ancestors, shared)
+        ancestors.pop(node)
+
+def compute_style(node, index, ancestors):
+    """
+    Runs the cascade for one node, returns its computed style.
+    """
+    style = {}
 
     # Inheritance
     for property, default_value in INHERITED_PROPERTIES.items():
         if node.parent:
-            node.style[property] = node.parent.style[property]
+            style[property] = node.parent.style[property]
         else:
-            node.style[property] = default_value
+            style[property] = default_value
 
     # CSS Rules Applied
-    for selector, body in rules:
+    candidates = index.candidates(node)
+    count("selector match attempts", len(candidates))
+    for selector, body, fingerprint in candidates:
+        if fingerprint and not ancestors.may_match(fingerprint): continue
         if not selector.matches(node): continue
         for property, value in body.items():
-            node.style[property] = value
+            style[property] = value
         
     # Inline styles
     if isinstance(node, Element) and "style" in node.attributes:
         pairs = CSSParser(node.attributes["style"]).body()
         for property, value in pairs.items():
-            node.style[property] = value
+            style[property] = value
     
     # Compute font sizes (%)
-    if node.style["font-size"].endswith("%"):
+    if style["font-size"].endswith("%"):
         if node.parent:
             parent_font_size = node.parent.style["font-size"]
         else:
             parent_font_size = INHERITED_PROPERTIES["font-size"]
-        node_pct = float(node.style["font-size"][:-1]) / 100
+        node_pct = float(style["font-size"][:-1]) / 100
         parent_px = float(parent_font_size[:-2])
-        node.style["font-size"] = str(node_pct * parent_px) + "px"
+        style["font-size"] = sys.intern(str(node_pct * parent_px) + "px")
 
-    # Recurse children
-    for child in node.children:
-        style(child, rules)
+    return style
 
 def cascade_priority(rule):
     selector, body = rule
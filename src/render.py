@@ -1,14 +1,31 @@
-import tkinter
-from tkinter import ttk
-from src.browse import URL, Text, HTMLParser, Element
-from src.css import CSSParser, style, cascade_priority
-from src.utils import tree_to_list, DrawRect, DrawText, get_font
+from src.aio import AsyncFetcher
+from src.backend import TkBackend, HeadlessBackend
+from src.browse import URL, Text, HTMLParser, Element, ConnectionPool, \
+    mark_style_dirty, copy_tree
+from src.cache import HTTPCache, StylesheetCache, SnapshotStore, \
+    CACHE_DIR, STYLESHEET_CACHE_DIR, snapshot_key
+from src.css import RuleIndex, style, restyle, cascade_priority
+from src.trace import span, traced, count
+from src.utils import tree_to_list, DisplayList, DisplayListIndex, \
+    get_font, measure, font_metrics, set_backend
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+from array import array
 from pathlib import Path
+import queue
 import sys
+import threading
+import time
 
 WIDTH, HEIGHT = 800, 600
 HSTEP, VSTEP = 13, 18
 SCROLL_STEP = 100
+MAX_FETCHES = 6 # Stylesheets fetched at once
+FRAME_MS = 16 # Resize events are coalesced to one reflow per frame
+PREFETCH = 600 # Canvas items are kept this far above and below the view
+LAYOUT_SLICE_MS = 8 # Background layout runs this long between events
+POLL_MS = 10 # How often the window checks on a page loading in the background
 MAX_Y = 600
 BLOCK_ELEMENTS = [
     "html", "body", "article", "section", "nav", "aside",
@@ -22,80 +39,435 @@ BASE_DIR = Path(__file__).resolve().parent
 CSS_PATH = BASE_DIR.parent / "assets" / "browser.css"
 
 
+STYLESHEETS = StylesheetCache(STYLESHEET_CACHE_DIR)
+# Display list of boxes without text, shared and never modified
+NO_TEXT = DisplayList()
+
 with open(CSS_PATH, "r") as f:
-    DEFAULT_STYLE_SHEET = CSSParser(f.read()).parse()
+    DEFAULT_STYLE_SHEET = STYLESHEETS.parse(f.read())
     
 class Browser:
-    def __init__(self):
+    def __init__(self, max_fetches=MAX_FETCHES, backend=None, snapshots=None):
+        self.max_fetches = max_fetches
+        # A SnapshotStore, to draw pages seen before while they load
+        self.snapshots = snapshots
+        self.snapshot = None
+        self.snapshot_key = None
+        self.source_hash = None
+        self.snapshot_lookup = None # Future of a snapshot being read
+        self.snapshot_reader = None
+        # Nothing to show until the first page's first screen arrives
+        self.document = None
+        self.painted_bottom = None
+        self.max_scroll = 0
+        self.backend = backend if backend is not None else TkBackend()
+        set_backend(self.backend)
         self.DEFAULT_STYLE_SHEET = DEFAULT_STYLE_SHEET#CSSParser(open("browser.css").read()).parse()
-        self.window = tkinter.Tk()
-        self.canvas = tkinter.Canvas(
-            self.window,
-            width=WIDTH,
-            height=HEIGHT,
-            scrollregion=(0, 0, WIDTH, HEIGHT),
-            bg="white"
-        )
-        self.canvas.pack(fill="both", expand=True)
+        self.pool = ConnectionPool()
+        self.cache = HTTPCache(CACHE_DIR)
+        self.window = self.backend.create_window("Chromatic")
+        self.canvas = self.backend.create_canvas(self.window, WIDTH, HEIGHT)
         self.scroll = 0
-        self.window.title("Chromatic")
+        self.layout_scheduled = False
+        self.painter = None
+        self.loader = None
         self.window.bind("<Down>", self.scrolldown)
         self.window.bind("<Up>", self.scrollup)
         self.window.bind("<MouseWheel>", self.mousewheel)
         self.window.bind("<Configure>", self.window_resize)
 
         # Scrollbar
-        self.scrollbar = ttk.Scrollbar(self.window, 
-                                  orient="vertical", 
-                                  command = self.on_scroll)
-        self.scrollbar.place(relx = 1, rely = 0, relheight = 1, anchor = "ne")
+        self.scrollbar = self.backend.create_scrollbar(self.window,
+                                                       self.on_scroll)
 
 
     def load(self, url):
         """
-        Obtains source code, delegates to other methods.
+        Obtains source code, delegates to other methods. The source is
+        parsed as it streams in, and the partial tree is rendered until it
+        fills the first screen, so that screen shows before the download
+        finishes. A stored snapshot of the page is read meanwhile, and
+        drawn once read if there is one.
         """
-        body = url.request()
-        self.nodes = HTMLParser(body).parse()
+        self.cancel_load()
+        self.url = url
+        self.scroll = 0
+        self.stylesheets = {}
+        self.timings = []
+        parser = HTMLParser()
+        source_hash = hashlib.sha256()
+        self.load_start = start = time.perf_counter()
+        self.lookup_snapshot()
+        first_screen = False
+        chunks = url.stream(pool=self.pool, cache=self.cache)
+        while True:
+            # Time spent waiting on the network, apart from parsing
+            with span("URL.stream", url=str(url)):
+                chunk = next(chunks, None)
+            if self.show_snapshot(wait=chunk is None):
+                first_screen = True
+            if chunk is None: break
+            source_hash.update(chunk.encode("utf8"))
+            with span("HTMLParser.feed", size=len(chunk)):
+                parser.feed(chunk)
+            if first_screen: continue
+            self.nodes = parser.partial_tree()
+            if self.nodes is None: continue
+            # Partial trees are replaced wholesale, so only the first
+            # screen of each is laid out
+            self.render(background=False)
+            self.window.update()
+            first_screen = self.document.height >= HEIGHT
+        self.timings.append(("document", start, time.perf_counter()))
+        with span("HTMLParser.close"):
+            self.nodes = parser.close()
         #b.print_tree(self.nodes) TO PRINT TREE IN TERMINAL
+        self.source_hash = source_hash.hexdigest()
+        self.render()
+
+    async def load_async(self, url, fetcher=None):
+        """
+        Like load(), but on the running asyncio event loop: fetches the
+        document, then all its stylesheets concurrently, and renders once
+        they have arrived.
+        """
+        self.cancel_load()
+        self.url = url
+        self.scroll = 0
+        self.stylesheets = {}
+        self.timings = []
+        if fetcher is None:
+            fetcher = AsyncFetcher(cache=self.cache)
+        self.load_start = start = time.perf_counter()
+        self.lookup_snapshot()
+        request = asyncio.ensure_future(fetcher.request(url))
+        if self.snapshot_lookup is not None:
+            await asyncio.wrap_future(self.snapshot_lookup)
+            self.show_snapshot()
+        body = await request
+        self.timings.append(("document", start, time.perf_counter()))
+        self.source_hash = hashlib.sha256(body.encode("utf8")).hexdigest()
+        self.nodes = HTMLParser(body).parse()
+        links = stylesheet_links(self.nodes)
+        stylesheets = await fetch_stylesheets_async(url, links, fetcher)
+        for link, (sheet, start, end) in stylesheets.items():
+            self.stylesheets[link] = sheet
+            self.timings.append((link, start, end))
+        self.render()
+
+    def navigate(self, url, on_load=None):
+        """
+        Loads url like load(), but fetching, parsing and styling run on a
+        worker thread while the window keeps drawing and handling input.
+        The first screen is shown as soon as it is styled, the whole page
+        once it has loaded, and then on_load is called. Navigating again
+        cancels a load still in progress. A stored snapshot of the page,
+        if any, is read meanwhile and stands in for the first screen.
+        """
+        self.cancel_load()
+        self.url = url
+        self.scroll = 0
+        self.load_start = time.perf_counter()
+        self.on_load = on_load
+        self.loader = Loader(url, self.pool, self.cache, self.max_fetches)
+        self.loader.start()
+        self.lookup_snapshot()
+        self.window.after(POLL_MS, self.poll_loader, self.loader)
+
+    def cancel_load(self):
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+        self.source_hash = None
+        self.snapshot_lookup = None
+
+    def snapshot_name(self):
+        return (str(self.url), WIDTH, type(self.backend).__name__)
+
+    def lookup_snapshot(self):
+        """
+        Starts reading the stored snapshot of the page at this width on a
+        worker thread, so the page's own fetch isn't held up by it.
+        """
+        self.snapshot = None
+        self.snapshot_lookup = None
+        if self.snapshots is None: return
+        if self.snapshot_reader is None:
+            self.snapshot_reader = ThreadPoolExecutor(1)
+        self.snapshot_lookup = self.snapshot_reader.submit(
+            self.snapshots.read, self.snapshot_name())
 
-        rules = self.DEFAULT_STYLE_SHEET.copy()
-        links = [node.attributes["href"]
-            for node in tree_to_list(self.nodes, [])
-            if isinstance(node, Element)
-            and node.tag == "link"
-            and node.attributes.get("rel") == "stylesheet"
-            and "href" in node.attributes]
-        for link in links:
-            style_url = url.resolve(link)
+    def show_snapshot(self, wait=False):
+        """
+        Draws the snapshot lookup_snapshot started reading, once read (or
+        after waiting for it, with wait), until the page has loaded.
+        Returns whether it drew one.
+        """
+        lookup = self.snapshot_lookup
+        if lookup is None or not (wait or lookup.done()): return False
+        self.snapshot_lookup = None
+        with span("snapshot lookup"):
+            self.snapshot = lookup.result()
+            if self.snapshot is None: return False
+            self.snapshot.resolve()
+        self.document = None
+        self.painted_bottom = None
+        self.set_display_list(self.snapshot.display_list, self.snapshot.index)
+        self.draw()
+        return True
+
+    def poll_loader(self, loader):
+        """
+        Shows whatever the loader has finished since the last poll. Only
+        the newest partial tree is drawn; older ones are already stale.
+        """
+        if loader is not self.loader: return # Cancelled
+        if self.show_snapshot():
+            loader.first_screen.set()
+        partial = None
+        while True:
             try:
-                body = style_url.request()
-            except:
+                message = loader.messages.get_nowait()
+            except queue.Empty:
+                break
+            kind = message[0]
+            if kind == "error":
+                self.loader = None
+                raise message[1]
+            if kind == "partial":
+                partial = message
                 continue
-            rules.extend(CSSParser(body).parse())
+            kind, self.nodes, self.rules, self.rule_index, \
+                self.stylesheets, self.timings, self.source_hash = message
+            self.loader = None
+            # show() keeps the snapshot if it is current
+            self.show_snapshot(wait=True)
+            self.show()
+            if self.on_load: self.on_load()
+            return
+        if partial and self.snapshot is None:
+            kind, self.nodes, self.rules, self.rule_index = partial
+            self.show(background=False)
+            if self.document.height >= HEIGHT:
+                loader.first_screen.set()
+            loader.ready.set()
+        self.window.after(POLL_MS, self.poll_loader, loader)
 
-        style(self.nodes, sorted(rules, key=cascade_priority))
+    def render(self, background=True):
+        """
+        Styles, lays out and paints the current tree, then draws it.
+        Stylesheets are fetched the first time their link shows up.
+        """
+        self.rules, self.rule_index = page_rules(
+            self.url, self.nodes, self.stylesheets, self.timings,
+            self.pool, self.cache, self.max_fetches)
+        style(self.nodes, self.rule_index)
         ## call style in load method, after parsing HTML, before layout
+        self.show(background)
 
+    def show(self, background=True):
+        """
+        Lays out, paints and draws the styled tree. Only the first screen
+        is laid out before drawing; with background the rest follows
+        while the window is idle.
+
+        Once the whole page is loaded, a snapshot on screen that was
+        rendered from the same source, rules and width is kept as it is
+        and layout is put off until something needs it. Otherwise the
+        page is snapshotted when its layout completes.
+        """
+        if self.snapshots is not None and self.source_hash is not None:
+            self.snapshot_key = snapshot_key(self.source_hash, self.rules,
+                                             WIDTH)
+            if self.snapshot is not None \
+                and self.snapshot.key == self.snapshot_key:
+                self.snapshot_key = None
+                self.document = None
+                self.draw()
+                return
+        self.snapshot = None
         self.document = DocumentLayout(self.nodes)
-        self.document.layout()
-        self.display_list = []
-        paint_tree(self.document, self.display_list)
+        self.layout(self.scroll + HEIGHT + PREFETCH, background)
+        self.draw()
 
+    def update(self):
+        """
+        Brings style, layout and paint up to date after the tree was
+        changed through the mutation methods on Element and Text, redoing
+        only what they marked dirty.
+        """
+        restyle(self.nodes, self.rule_index)
+        if self.document is None:
+            self.document = DocumentLayout(self.nodes)
+        document = self.document
+        if document.complete:
+            self.layout(None)
+        else:
+            self.layout(max(self.scroll + HEIGHT + PREFETCH,
+                            document.y + document.height))
         self.draw()
 
+    def layout(self, until, background=True):
+        """
+        Lays out the document at least down to y = until, or all of it if
+        until is None, and paints what is laid out. The rest is laid out
+        in the background unless told otherwise.
+        """
+        self.document.layout(until)
+        self.paint()
+        if background and not self.document.complete \
+            and not self.layout_scheduled:
+            self.layout_scheduled = True
+            self.window.after_idle(self.layout_more)
+
+    def layout_more(self):
+        """
+        Lays out the next part of the document in slices until
+        LAYOUT_SLICE_MS is used up, then yields to pending events.
+        Each slice paints what it laid out onto the end of the display
+        list, so no slice repaints the whole document.
+        """
+        self.layout_scheduled = False
+        document = self.document
+        if document is None or document.complete: return
+        deadline = time.perf_counter() + LAYOUT_SLICE_MS / 1000
+        with span("layout_more"):
+            while not document.complete and time.perf_counter() < deadline:
+                document.layout(document.y + document.height + HEIGHT)
+        self.paint_more()
+        if not document.complete:
+            self.layout_scheduled = True
+            self.window.after_idle(self.layout_more)
+        self.draw()
+
+    def paint(self):
+        """
+        Rebuilds the display list from the layout tree, and the index
+        draw() uses to find what's on screen.
+        """
+        display_list = DisplayList()
+        self.painter = Painter(self.document, display_list)
+        with span("paint_tree"):
+            self.painter.paint()
+        self.set_display_list(display_list, DisplayListIndex(
+            display_list, loose=self.painter.open_commands()))
+        self.painted()
+
+    def paint_more(self):
+        """
+        Paints what was laid out since the last paint onto the end of the
+        display list, keeping its index and the canvas items drawn. The
+        backgrounds of boxes still being laid out are redrawn in place.
+        """
+        grown = self.display_index.loose
+        with span("paint_more"):
+            final = self.painter.paint()
+        self.display_index.add(final)
+        self.display_index.loose = self.painter.open_commands()
+        display_list = self.display_list
+        for i in grown:
+            if i in self.items:
+                self.canvas.coords(self.items[i], display_list.lefts[i],
+                                   display_list.tops[i] - self.drawn_scroll,
+                                   display_list.rights[i],
+                                   display_list.bottoms[i] - self.drawn_scroll)
+        self.band = None # Let draw_retained pick up the new commands
+        self.painted()
+
+    def painted(self):
+        """
+        Notes how far the display list reaches, and snapshots the page
+        once it is all painted.
+        """
+        self.painted_bottom = None if self.document.complete \
+            else self.document.y + self.document.height
+        display_list = self.display_list
+        if self.document.complete and self.snapshot_key is not None:
+            with span("snapshot store"):
+                self.snapshots.store(self.snapshot_name(), self.snapshot_key,
+                                     self.document.height, display_list,
+                                     self.display_index)
+            self.snapshot_key = None
+
+    def set_display_list(self, display_list, index=None):
+        self.display_list = display_list
+        self.display_index = index if index is not None \
+            else DisplayListIndex(display_list)
+
+        # Canvas items belong to the old display list
+        self.canvas.delete("all")
+        self.items = {}
+        self.band = None
+        self.drawn_scroll = self.scroll
+
+    def draw_retained(self):
+        """
+        Keeps canvas items alive for the commands within PREFETCH pixels
+        of the viewport. Scrolling inside that band just moves the
+        existing items; items are only created and deleted as the band
+        slides along.
+        """
+        dy = self.drawn_scroll - self.scroll
+        if dy:
+            self.canvas.move("all", 0, dy)
+            self.drawn_scroll = self.scroll
+        top, bottom = self.scroll, self.scroll + HEIGHT
+        if self.band and self.band[0] <= top and bottom <= self.band[1]:
+            return
+
+        self.band = (top - PREFETCH, bottom + PREFETCH)
+        wanted = self.display_index.visible_indices(*self.band)
+        keep = set(wanted)
+        for i in [i for i in self.items if i not in keep]:
+            self.canvas.delete(self.items.pop(i))
+        created = 0
+        for i in wanted:
+            if i not in self.items:
+                self.items[i] = self.display_list.execute(
+                    i, self.scroll, self.canvas)
+                created += 1
+        count("canvas items created", created)
+
+    def add_stylesheet(self, text):
+        """
+        Adds a stylesheet's rules after the page's, then restyles.
+        """
+        self.rules = self.rules + STYLESHEETS.parse(text)
+        self.rule_index = RuleIndex(sorted(self.rules, key=cascade_priority))
+        mark_style_dirty(self.nodes)
+        self.update()
+
+    def print_timings(self):
+        """
+        Prints when each resource of the last load started and finished,
+        relative to the start of the load. The latest finish is the
+        critical path.
+        """
+        for name, start, end in sorted(self.timings, key=lambda t: t[1]):
+            print("{:>8.1f}ms {:>8.1f}ms  {}".format(
+                (start - self.load_start) * 1000,
+                (end - start) * 1000, name))
+        if self.timings:
+            last = max(end for name, start, end in self.timings)
+            print("critical path: {:.1f}ms".format(
+                (last - self.load_start) * 1000))
+
+    @traced("Browser.draw")
     def draw(self):
         """
         Visualizes all characters onto screen.
         """
         #max_bottom = HEIGHT
-        max_bottom = self.document.height + 2*VSTEP
+        if self.document is None and self.snapshot is None: return
+        # Scrolled near the end of a partial layout: lay out the rest of
+        # the band now instead of waiting for the background
+        bottom = self.scroll + HEIGHT + PREFETCH
+        if self.painted_bottom is not None and bottom > self.painted_bottom:
+            self.document.layout(bottom)
+            self.paint_more()
+        max_bottom = self.page_height() + 2*VSTEP
 
-        self.canvas.delete("all")
-        for cmd in self.display_list:
-            if cmd.top > self.scroll + HEIGHT: continue
-            if cmd.bottom < self.scroll: continue
-            cmd.execute(self.scroll, self.canvas)
+        self.draw_retained()
 
         self.max_scroll = max(0, max_bottom - self.canvas.winfo_height())
         ## Update scrollbar y-value logic
@@ -113,10 +485,15 @@ class Browser:
         """
         Handles down arrow key event.
         """
-        max_y = max(self.document.height + 2*VSTEP - HEIGHT, 0)
+        max_y = max(self.page_height() + 2*VSTEP - HEIGHT, 0)
         self.scroll = min(self.scroll + SCROLL_STEP, max_y)
         self.draw()
 
+    def page_height(self):
+        if self.document is not None: return self.document.height
+        if self.snapshot is not None: return self.snapshot.height
+        return 0
+
     def scrollup(self, e):
         """
         Handles up arrow key event.
@@ -177,44 +554,167 @@ class Browser:
 
     def window_resize(self, e):
         """
-        Handles window resize logic.
+        Handles window resize logic. Dragging the window edge sends a
+        stream of events, so they are coalesced: only the latest size is
+        applied, at most once per frame.
+        """
+        if e.widget is not self.window: return
+        self.pending_size = (e.width, e.height)
+        if not getattr(self, "resize_scheduled", False):
+            self.resize_scheduled = True
+            self.window.after(FRAME_MS, self.apply_resize)
+
+    def apply_resize(self):
+        """
+        Reflows the page for the latest window size. Laid out boxes and
+        their measured words are kept; only line breaking and vertical
+        positions are redone.
         """
         global WIDTH, HEIGHT
-        if e.width != WIDTH and e.height != HEIGHT:
-            WIDTH = e.width
-            HEIGHT = e.height
-            self.document = DocumentLayout(self.nodes)
+        self.resize_scheduled = False
+        width, height = self.pending_size
+        if width == WIDTH and height == HEIGHT: return
+        reflow = width != WIDTH
+        WIDTH, HEIGHT = width, height
+        if self.document is None and self.snapshot is None: return
+        if reflow:
+            if self.document is None:
+                # Only a snapshot is showing. A load in progress will lay
+                # out at the new width; a finished one is laid out now
+                if self.source_hash is None:
+                    self.draw()
+                    return
+                self.document = DocumentLayout(self.nodes)
+            self.layout(self.scroll + HEIGHT + PREFETCH)
+        self.draw()
+
+class Loader:
+    """
+    Fetches, parses and styles a page on a worker thread. Results go on
+    the messages queue for the window's thread to pick up:
+
+        ("partial", nodes, rules, rule_index)   until first_screen is set,
+                                                only while ready is set
+        ("done", nodes, rules, rule_index, stylesheets, timings,
+         source_hash)
+        ("error", exception)
+
+    Partial trees are styled copies, so the worker can keep parsing
+    while the window lays them out. Once cancelled, the worker stops at
+    its next check and sends nothing more.
+    """
+    def __init__(self, url, pool=None, cache=None, max_fetches=MAX_FETCHES):
+        self.url = url
+        self.pool = pool
+        self.cache = cache
+        self.max_fetches = max_fetches
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.first_screen = threading.Event()
+        # Cleared while a partial tree waits to be shown, so a fast
+        # download doesn't copy and style a tree for every chunk
+        self.ready = threading.Event()
+        self.ready.set()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
 
-            self.document.layout()
-            self.display_list = []
-            paint_tree(self.document, self.display_list)
-            self.draw()
+    def run(self):
+        try:
+            self.load()
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.messages.put(("error", e))
+
+    def load(self):
+        url = self.url
+        stylesheets = {}
+        timings = []
+        parser = HTMLParser()
+        source_hash = hashlib.sha256()
+        start = time.perf_counter()
+        chunks = url.stream(pool=self.pool, cache=self.cache)
+        try:
+            while True:
+                with span("URL.stream", url=str(url)):
+                    chunk = next(chunks, None)
+                if chunk is None: break
+                if self.cancelled.is_set(): return
+                source_hash.update(chunk.encode("utf8"))
+                with span("HTMLParser.feed", size=len(chunk)):
+                    parser.feed(chunk)
+                if self.first_screen.is_set() or not self.ready.is_set():
+                    continue
+                root = parser.partial_tree()
+                if root is None: continue
+                self.ready.clear()
+                nodes = copy_tree(root)
+                rules, rule_index = page_rules(
+                    url, nodes, stylesheets, timings, self.pool,
+                    self.cache, self.max_fetches)
+                style(nodes, rule_index)
+                self.messages.put(("partial", nodes, rules, rule_index))
+        finally:
+            chunks.close()
+        timings.append(("document", start, time.perf_counter()))
+        with span("HTMLParser.close"):
+            nodes = parser.close()
+        if self.cancelled.is_set(): return
+        rules, rule_index = page_rules(url, nodes, stylesheets, timings,
+                                       self.pool, self.cache,
+                                       self.max_fetches)
+        if self.cancelled.is_set(): return
+        style(nodes, rule_index)
+        if self.cancelled.is_set(): return
+        self.messages.put(("done", nodes, rules, rule_index, stylesheets,
+                           timings, source_hash.hexdigest()))
 
 class DocumentLayout:
+    __slots__ = ("node", "parent", "children", "x", "y", "width", "height",
+                 "laid", "complete")
+
     def __init__(self, node):
         self.node = node
         self.parent = None
         self.children = []
+        self.laid = 1
+        self.complete = False
 
         self.x = 0
         self.y = 0
         self.width = 0
         self.height = 0
         
-    def layout(self):
-        child = BlockLayout(self.node, self, None)
-        self.children.append(child)
+    def layout(self, until=None):
+        """
+        Lays out the document. Called again, it reuses the existing layout
+        tree and only redoes the boxes whose nodes were marked dirty.
+        With until, it stops once boxes reach that y, leaving complete
+        False; the next call carries on from there.
+        """
+        if not self.children:
+            self.children.append(BlockLayout(self.node, self, None))
+        child = self.children[0]
 
         self.width = WIDTH - 2*HSTEP
         self.x = HSTEP
         self.y = VSTEP
-        child.layout()
+        child.layout(until)
         self.height = child.height
+        self.complete = child.complete
 
     def paint(self):
-        return []
+        return DisplayList()
 
 class BlockLayout:
+    __slots__ = ("node", "parent", "previous", "children", "display_list",
+                 "words", "laid_out", "laid", "complete", "x", "y", "width",
+                 "height", "cursor_x", "cursor_y", "line")
+
     def __init__(self, node, parent, previous):
         """
         Sorts through all tokens. 
@@ -223,7 +723,11 @@ class BlockLayout:
         self.parent = parent
         self.previous = previous
         self.children = []
-        self.display_list = []
+        self.display_list = NO_TEXT # This box's text, placed
+        self.words = None # Shaped runs, kept until the subtree changes
+        self.laid_out = False
+        self.laid = 0 # Children laid out so far, the last maybe partly
+        self.complete = False
 
         ## Default values instead of 'None' to suppress warnings.
         self.x = 0
@@ -246,49 +750,118 @@ class BlockLayout:
         else:
             return "block"
 
-    def layout(self):        
-        self.x = self.parent.x
-        self.width = self.parent.width
+    @traced("BlockLayout.layout")
+    def layout(self, until=None):
+        """
+        Lays out this box and its children, stopping after the first child
+        that reaches y = until. A box left incomplete resumes from that
+        child the next time round.
+        """
+        x = self.parent.x
+        width = self.parent.width
 
         if self.previous:
-            self.y = self.previous.y + self.previous.height
+            y = self.previous.y + self.previous.height
         else:
-            self.y = self.parent.y
+            y = self.parent.y
+
+        # A clean box only needs moving if something above it changed
+        node = self.node
+        if self.laid_out and not node.needs_layout \
+            and not node.child_needs_layout \
+            and x == self.x and width == self.width:
+            if y != self.y: self.shift(y - self.y)
+            if self.complete: return
+            self.lay_children(max(0, self.laid - 1), until)
+            return
+
+        self.x, self.y, self.width = x, y, width
+        self.laid_out = True
+        rebuild = node.needs_layout
+        reshape = rebuild or node.child_needs_layout or self.words is None
+        node.needs_layout = node.child_needs_layout = False
 
         mode = self.layout_mode()
         if mode == "block":
-            previous = None
-            for child in self.node.children:
-                next = BlockLayout(child, self, previous)
-                self.children.append(next)
-                next.layout()
-                previous = next
-            self.height = sum([child.height for child in self.children])
+            self.display_list = NO_TEXT
+            if rebuild or not self.children:
+                self.build_children()
+            self.lay_children(0, until)
         else:
-            self.cursor_x = 0
-            self.cursor_y = 0
-            self.weight = "normal"
-            self.style = "roman"
-            self.size = 12
-            self.line = []
-            self.recurse(self.node)
-            self.flush()
-            self.height = self.cursor_y
+            self.children = []
+            self.laid = 0
+            self.complete = True
+            # Only a changed subtree needs its words measured again; a new
+            # width just breaks the same words into different lines
+            if reshape:
+                self.words = []
+                self.recurse(self.node)
+            self.break_lines()
+
+    def lay_children(self, start, until):
+        """
+        Lays out children from start on, until one ends below until.
+        """
+        children = self.children
+        i = start
+        while i < len(children):
+            child = children[i]
+            child.layout(until)
+            i += 1
+            if not child.complete or \
+                (until is not None and child.y + child.height >= until):
+                break
+        self.laid = i
+        self.complete = i == len(children) \
+            and (not children or children[-1].complete)
+        if i:
+            last = children[i - 1]
+            self.height = last.y + last.height - self.y
+        else:
+            self.height = 0
+
+    def build_children(self):
+        """
+        Matches child boxes to the node's current children, keeping the
+        boxes of children that are still there.
+        """
+        old = {id(child.node): child for child in self.children}
+        self.children = []
+        previous = None
+        for child in self.node.children:
+            next = old.get(id(child))
+            if next is None:
+                next = BlockLayout(child, self, previous)
+            next.previous = previous
+            self.children.append(next)
+            previous = next
+
+    def shift(self, dy):
+        """
+        Moves this laid out box and everything in it down by dy.
+        """
+        self.y += dy
+        if self.display_list:
+            self.display_list.shift(dy)
+        for child in self.children:
+            child.shift(dy)
 
     def recurse(self, node):
+        node.needs_layout = node.child_needs_layout = False
         if isinstance(node, Text):
-            for word in node.text.split():
-                self.word(node, word)
+            words = node.text.split()
+            if words:
+                self.words.append(self.shape(node, words))
         else:
             if node.tag == "br":
-                self.flush()
+                self.words.append(None) # Forced line break
             for child in node.children:
                 self.recurse(child)
-    
-    def word(self, node, word):
+
+    def shape(self, node, words):
         """
-        Gets a word, sets font, finds appropriate location for rendering,
-        adds to self.line while updating x, y values for future words.
+        Gets the font and color of a text node's words and measures them.
+        Returns them as one run: font, color, space width, words, widths.
         """
         weight = node.style["font-weight"]
         style = node.style["font-style"]
@@ -296,58 +869,275 @@ class BlockLayout:
         size = int(float(node.style["font-size"][:-2]) * .75)
         font = get_font(size, weight, style)
         color = node.style["color"]
-        w = font.measure(word)
+        widths = array("d", [measure(font, word) for word in words])
+        return font, color, measure(font, " "), words, widths
 
+    def break_lines(self):
+        """
+        Places the shaped words into lines that fit the current width.
+        """
+        self.display_list = DisplayList()
+        self.cursor_x = 0
+        self.cursor_y = 0
+        self.line = []
+        for run in self.words:
+            if run is None:
+                self.flush()
+                continue
+            font, color, space, words, widths = run
+            for word, w in zip(words, widths):
+                self.word(word, font, color, w, space)
+        self.flush()
+        self.height = self.cursor_y
+        if not self.display_list:
+            self.display_list = NO_TEXT
+    
+    def word(self, word, font, color, w, space):
+        """
+        Finds appropriate location for rendering a shaped word, adds to
+        self.line while updating x, y values for future words.
+        """
         if self.cursor_x + w > self.width:
             # if out of range
             self.flush()
                 
         self.line.append((self.cursor_x, word, font, color))
-        self.cursor_x += w + font.measure(" ")
+        self.cursor_x += w + space
 
     def flush(self):
         """
         Gathers font metrics, computes a baseline for all words, computes
         y-pos for all words so they all sit on baseline, adds these values to
         display_list, y-value step down, resets self.line for upcoming lines.
+        Neighbouring words in the same font and color go into the display
+        list as one run of text, drawn as one canvas item.
         """
         if not self.line: return
-        metrics = [font.metrics() for x, word, font, color in self.line]
+        metrics = [font_metrics(font) for x, word, font, color in self.line]
         max_ascent = max([metric["ascent"] for metric in metrics])
         baseline = self.cursor_y + 1.25 * max_ascent
 
+        # Each word already sits one space after the previous one, so a run
+        # joined with spaces lands every word where it was placed
+        run = []
+        run_x = run_font = run_color = None
         for rel_x, word, font, color in self.line:
-            x = self.x + rel_x
-            y = self.y + baseline - font.metrics("ascent")
-            self.display_list.append((x, y, word, font, color))
-        
+            if font is not run_font or color != run_color:
+                if run: self.add_run(run_x, baseline, run, run_font, run_color)
+                run = []
+                run_x, run_font, run_color = rel_x, font, color
+            run.append(word)
+        self.add_run(run_x, baseline, run, run_font, run_color)
+
         max_descent = max([metric["descent"] for metric in metrics])
         self.cursor_y = baseline + 1.25 * max_descent
 
         self.cursor_x = 0
         self.line = []
 
-    def paint(self):
-        cmds = []
+    def add_run(self, rel_x, baseline, words, font, color):
+        x = self.x + rel_x
+        y = self.y + baseline - font_metrics(font, "ascent")
+        self.display_list.append_text(x, y, " ".join(words), font, color)
 
-        # css background
+    def paint(self):
+        """
+        The box's text, already placed by layout, behind its css
+        background if it has one.
+        """
         bgcolor = self.node.style.get("background-color", "transparent")
-        if bgcolor != "transparent":
-            x2, y2 = self.x + self.width, self.y + self.height
-            rect = DrawRect(self.x, self.y, x2, y2, bgcolor)
-            cmds.append(rect)
-
-        # inline text
-        if self.layout_mode() == "inline":
-            for x, y, word, font, color in self.display_list:
-                cmds.append(DrawText(x, y, word, font, color))
+        if bgcolor == "transparent":
+            return self.display_list
+        cmds = DisplayList()
+        x2, y2 = self.x + self.width, self.y + self.height
+        cmds.append_rect(self.x, self.y, x2, y2, bgcolor)
+        cmds.extend(self.display_list)
         return cmds
 
+def stylesheet_links(nodes):
+    """
+    The href of every stylesheet link in the tree, in document order.
+    """
+    return [node.attributes["href"]
+        for node in tree_to_list(nodes, [])
+        if isinstance(node, Element)
+        and node.tag == "link"
+        and node.attributes.get("rel") == "stylesheet"
+        and "href" in node.attributes]
+
+def page_rules(url, nodes, stylesheets, timings, pool=None, cache=None,
+               max_fetches=MAX_FETCHES):
+    """
+    The user-agent rules followed by those of each stylesheet linked
+    from nodes, and a RuleIndex of them. Stylesheets not already in
+    stylesheets are fetched and added to it, with their timings.
+    """
+    rules = DEFAULT_STYLE_SHEET.copy()
+    links = stylesheet_links(nodes)
+    # Each new stylesheet is fetched on its own thread; rules are
+    # still added in document order so the cascade is unchanged
+    missing = [link for link in dict.fromkeys(links)
+               if link not in stylesheets]
+    if missing:
+        with ThreadPoolExecutor(max_fetches) as executor:
+            results = executor.map(
+                lambda link: fetch_stylesheet(url, link, pool, cache),
+                missing)
+            for link, (sheet, start, end) in zip(missing, results):
+                stylesheets[link] = sheet
+                timings.append((link, start, end))
+    for link in links:
+        rules.extend(stylesheets[link])
+    return rules, RuleIndex(sorted(rules, key=cascade_priority))
+
+def fetch_stylesheet(url, link, pool=None, cache=None):
+    """
+    Fetches and parses the stylesheet link points to. Returns its rules,
+    empty if it can't be loaded, with the fetch's start and end times.
+    """
+    start = time.perf_counter()
+    try:
+        with span("fetch stylesheet", url=link):
+            body = url.resolve(link).request(pool=pool, cache=cache)
+        with span("parse stylesheet", url=link):
+            rules = STYLESHEETS.parse(body)
+    except:
+        rules = []
+    return rules, start, time.perf_counter()
+
+async def fetch_stylesheet_async(url, link, fetcher):
+    """
+    fetch_stylesheet on an AsyncFetcher.
+    """
+    start = time.perf_counter()
+    try:
+        body = await fetcher.request(url.resolve(link))
+        with span("parse stylesheet", url=link):
+            rules = STYLESHEETS.parse(body)
+    except Exception:
+        rules = []
+    return rules, start, time.perf_counter()
+
+async def fetch_stylesheets_async(url, links, fetcher):
+    """
+    Fetches every distinct stylesheet in links at once. Returns {link:
+    (rules, start, end)}.
+    """
+    links = list(dict.fromkeys(links))
+    results = await asyncio.gather(*[
+        fetch_stylesheet_async(url, link, fetcher) for link in links])
+    return dict(zip(links, results))
+
+async def fetch_page(url, fetcher):
+    """
+    Fetches and parses the document at url, then all of its stylesheets
+    concurrently. Returns the tree and {link: rules}.
+    """
+    body = await fetcher.request(url)
+    nodes = HTMLParser(body).parse()
+    stylesheets = await fetch_stylesheets_async(
+        url, stylesheet_links(nodes), fetcher)
+    return nodes, {link: rules
+                   for link, (rules, start, end) in stylesheets.items()}
+
 def paint_tree(layout_object, display_list):
-    display_list.extend(layout_object.paint())
-    for child in layout_object.children:
-        paint_tree(child, display_list)
+    """
+    Appends the paint output of layout_object and everything below it
+    to display_list.
+    """
+    parts = []
+    collect_paint(layout_object, parts)
+    display_list.join(parts)
+
+class Painter:
+    """
+    Paints a document that may still be being laid out. Complete boxes
+    are painted once, onto the end of the display list. The boxes on the
+    path down to where layout stopped are kept open, as their
+    backgrounds grow with every child laid out; each call to paint()
+    redraws those in place and carries on from where the last stopped.
+    """
+    def __init__(self, document, display_list):
+        self.display_list = display_list
+        # [box, children painted, position of its commands, their count]
+        self.stack = []
+        self.open(document)
+
+    def open(self, box):
+        start = len(self.display_list)
+        cmds = box.paint()
+        self.display_list.extend(cmds)
+        self.stack.append([box, 0, start, len(cmds)])
+
+    def open_commands(self):
+        """
+        Positions of the commands of the open boxes.
+        """
+        return [i for box, done, start, n in self.stack
+                for i in range(start, start + n)]
+
+    def paint(self):
+        """
+        Paints what was laid out since the last call. Returns the
+        positions of the commands that won't change any more.
+        """
+        display_list = self.display_list
+        final = []
+        for box, done, start, n in self.stack:
+            if n: display_list.replace(start, box.paint())
+        while self.stack:
+            entry = self.stack[-1]
+            box, done = entry[0], entry[1]
+            while done < box.laid and box.children[done].complete:
+                first = len(display_list)
+                paint_tree(box.children[done], display_list)
+                final.extend(range(first, len(display_list)))
+                done += 1
+            entry[1] = done
+            if done < box.laid:
+                # Partly laid out; painted again next time
+                self.open(box.children[done])
+                continue
+            if not box.complete: break
+            self.stack.pop()
+            final.extend(range(entry[2], entry[2] + entry[3]))
+            if self.stack: self.stack[-1][1] += 1
+        return final
+
+def collect_paint(layout_object, parts):
+    cmds = layout_object.paint()
+    if cmds: parts.append(cmds)
+    # Children past the laid out ones may hold a stale layout
+    for child in layout_object.children[:layout_object.laid]:
+        collect_paint(child, parts)
 
-def start(arg):
-    Browser().load(URL(arg))
-    tkinter.mainloop()
\ No newline at end of file
+def start(arg, timings=False, headless=False, commands=None, image=None,
+          use_async=False, snapshots=False):
+    """
+    Loads arg in a browser window, or without one if headless, then saves
+    the drawn canvas as a command stream and/or a PPM image if asked.
+    In a window the page loads on a worker thread, so the window stays
+    responsive. With use_async, the page and its stylesheets are fetched
+    on an asyncio event loop instead of streamed. With snapshots, pages
+    are drawn from and saved to the snapshot store.
+    """
+    backend = HeadlessBackend() if headless else TkBackend()
+    browser = Browser(backend=backend,
+                      snapshots=SnapshotStore() if snapshots else None)
+    if use_async:
+        asyncio.run(browser.load_async(URL(arg)))
+    elif headless:
+        browser.load(URL(arg))
+    else:
+        browser.navigate(URL(arg), browser.print_timings if timings else None)
+        browser.window.mainloop()
+        return
+    # Finish the background layout so what's saved is the whole page
+    browser.window.update()
+    if timings:
+        browser.print_timings()
+    if commands:
+        browser.canvas.save_commands(commands)
+    if image:
+        browser.canvas.save_ppm(image)
+    browser.window.mainloop()
@@ -0,0 +1,134 @@
+import functools
+import json
+import os
+import threading
+import time
+
+# The active Tracer, or None when tracing is off (the default). Every
+# entry point checks this first, so tracing costs a call and a compare
+# when it's off.
+TRACER = None
+
+
+class Tracer:
+    """
+    Collects spans and counters as Chrome trace events, which
+    chrome://tracing and ui.perfetto.dev load directly. Spans may be
+    opened from any thread; each thread gets its own track.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.counters = {}
+        self.emitted = {}
+        self.lock = threading.Lock()
+
+    def now(self):
+        """
+        Microseconds since the tracer was created.
+        """
+        return (time.perf_counter() - self.start) * 1e6
+
+    def add_span(self, name, start, end, args):
+        event = {"name": name, "ph": "X", "ts": start, "dur": end - start,
+                 "pid": self.pid, "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+            # Counters are sampled when spans close, not on every count()
+            for name, value in self.counters.items():
+                if self.emitted.get(name) == value: continue
+                self.emitted[name] = value
+                self.events.append({"name": name, "ph": "C", "ts": end,
+                                    "pid": self.pid, "args": {name: value}})
+
+    def count(self, name, n):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_json(self):
+        with self.lock:
+            events = list(self.events)
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"counters": dict(self.counters)}}
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f)
+
+class Span:
+    """
+    Times a with-block into the tracer as one complete event.
+    """
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.begin = self.tracer.now()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.add_span(self.name, self.begin, self.tracer.now(),
+                             self.args)
+        return False
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def enable():
+    """
+    Starts recording, dropping anything recorded before.
+    """
+    global TRACER
+    TRACER = Tracer()
+    return TRACER
+
+def disable():
+    global TRACER
+    TRACER = None
+
+def span(name, **args):
+    """
+    Context manager timing its block as a span named name, with args
+    shown alongside it in the trace viewer.
+    """
+    if TRACER is None: return NULL_SPAN
+    return Span(TRACER, name, args)
+
+def traced(name):
+    """
+    Decorator wrapping every call of a function in a span.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if TRACER is None:
+                return function(*args, **kwargs)
+            with Span(TRACER, name, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    """
+    Adds n to a counter, shown as a graph in the trace viewer.
+    """
+    if TRACER is not None:
+        TRACER.count(name, n)
+
+def export(path):
+    """
+    Writes what was recorded as Chrome trace-event JSON.
+    """
+    if TRACER is not None:
+        TRACER.export(path)
@@ -1,6 +1,31 @@
-import tkinter.font
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from operator import sub
+from src.backend import TkBackend
+from src.trace import count
 
+# Creates fonts; swapped with set_backend to run without a display.
+BACKEND = TkBackend()
 FONTS = {}
+# Tk answers every measure() and metrics() call with a round trip, so both
+# are cached here, keyed by the id of a font from get_font (those fonts are
+# only freed by set_backend, which clears these caches with them).
+FONT_METRICS = {}
+WORD_WIDTHS = OrderedDict()
+MAX_WORD_WIDTHS = 65536
+MEASURE_STATS = {
+    "width_hits": 0, "width_misses": 0,
+    "metrics_hits": 0, "metrics_misses": 0,
+}
+# Commands taller than this are kept out of the sorted display list index.
+TALL_COMMAND = 100
+# Fonts and colors of DisplayList commands, which store indices into
+# these instead of references. Fonts are looked up by id, as above.
+FONT_TABLE = []
+FONT_IDS = {}
+COLOR_TABLE = []
+COLOR_IDS = {}
 
 def tree_to_list(tree, list):
     list.append(tree)
@@ -9,16 +34,18 @@ def tree_to_list(tree, list):
     return list
 
 class DrawText:
+    __slots__ = ("top", "left", "text", "font", "color", "bottom")
+
     def __init__(self, x1, y1, text, font, color):
         self.top = y1
         self.left = x1
         self.text = text
         self.font = font
         self.color = color
-        self.bottom = y1 + font.metrics('linespace')
+        self.bottom = y1 + font_metrics(font, "linespace")
 
     def execute(self, scroll, canvas):
-        canvas.create_text(
+        return canvas.create_text(
             self.left, self.top - scroll,
             text = self.text,
             font = self.font,
@@ -26,6 +53,8 @@ class DrawText:
             anchor='nw')
 
 class DrawRect:
+    __slots__ = ("top", "left", "bottom", "right", "color")
+
     def __init__(self, x1, y1, x2, y2, color):
         self.top = y1
         self.left = x1
@@ -34,13 +63,223 @@ class DrawRect:
         self.color = color
 
     def execute(self, scroll, canvas):
-        canvas.create_rectangle(
+        return canvas.create_rectangle(
             self.left, self.top - scroll,
             self.right, self.bottom - scroll,
             width = 0,
             fill = self.color
         )
 
+class DisplayList:
+    """
+    Paint commands stored as columns rather than as one object each:
+    coordinates in float arrays, fonts and colors as indices into
+    FONT_TABLE and COLOR_TABLE, and the text of each command (None for a
+    rectangle) in a list. Indexing materializes a DrawText or DrawRect.
+    """
+    __slots__ = ("lefts", "tops", "rights", "bottoms", "texts", "fonts",
+                 "colors")
+
+    def __init__(self):
+        self.lefts = array("d")
+        self.tops = array("d")
+        self.rights = array("d")
+        self.bottoms = array("d")
+        self.texts = []
+        self.fonts = array("I")
+        self.colors = array("I")
+
+    def append_text(self, x, y, text, font, color):
+        self.lefts.append(x)
+        self.tops.append(y)
+        self.rights.append(x)
+        self.bottoms.append(y + font_metrics(font, "linespace"))
+        self.texts.append(text)
+        self.fonts.append(font_id(font))
+        self.colors.append(color_id(color))
+
+    def append_rect(self, x1, y1, x2, y2, color):
+        self.lefts.append(x1)
+        self.tops.append(y1)
+        self.rights.append(x2)
+        self.bottoms.append(y2)
+        self.texts.append(None)
+        self.fonts.append(0)
+        self.colors.append(color_id(color))
+
+    def replace(self, i, other):
+        """
+        Overwrites the commands from position i on with other's.
+        """
+        j = i + len(other)
+        self.lefts[i:j] = other.lefts
+        self.tops[i:j] = other.tops
+        self.rights[i:j] = other.rights
+        self.bottoms[i:j] = other.bottoms
+        self.texts[i:j] = other.texts
+        self.fonts[i:j] = other.fonts
+        self.colors[i:j] = other.colors
+
+    def extend(self, other):
+        self.lefts.extend(other.lefts)
+        self.tops.extend(other.tops)
+        self.rights.extend(other.rights)
+        self.bottoms.extend(other.bottoms)
+        self.texts.extend(other.texts)
+        self.fonts.extend(other.fonts)
+        self.colors.extend(other.colors)
+
+    def join(self, others):
+        """
+        Extends with each of others in turn, faster than extend() on each.
+        """
+        for column, name in [(self.lefts, "lefts"), (self.tops, "tops"),
+                             (self.rights, "rights"),
+                             (self.bottoms, "bottoms"), (self.texts, "texts"),
+                             (self.fonts, "fonts"), (self.colors, "colors")]:
+            extend = column.extend
+            for other in others:
+                extend(getattr(other, name))
+
+    def shift(self, dy):
+        """
+        Moves every command down by dy.
+        """
+        self.tops = array("d", [top + dy for top in self.tops])
+        self.bottoms = array("d", [bottom + dy for bottom in self.bottoms])
+
+    def execute(self, i, scroll, canvas):
+        return self[i].execute(scroll, canvas)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, i):
+        color = COLOR_TABLE[self.colors[i]]
+        text = self.texts[i]
+        if text is None:
+            return DrawRect(self.lefts[i], self.tops[i],
+                            self.rights[i], self.bottoms[i], color)
+        return DrawText(self.lefts[i], self.tops[i], text,
+                        FONT_TABLE[self.fonts[i]], color)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def font_id(font):
+    i = FONT_IDS.get(id(font))
+    if i is None:
+        i = FONT_IDS[id(font)] = len(FONT_TABLE)
+        FONT_TABLE.append(font)
+    return i
+
+def color_id(color):
+    i = COLOR_IDS.get(color)
+    if i is None:
+        i = COLOR_IDS[color] = len(COLOR_TABLE)
+        COLOR_TABLE.append(color)
+    return i
+
+class DisplayListIndex:
+    """
+    Display list commands sorted by top, so the ones intersecting the
+    viewport are found by binary search instead of a scan of the whole
+    list. Since the search has to reach back by the height of the
+    tallest command searched, tall commands (block backgrounds) are kept
+    apart, sorted by top in buckets of heights within a factor of two,
+    and each bucket is searched the same way. Loose commands, whose
+    geometry may still change, are checked directly.
+    """
+    def __init__(self, display_list, parts=None, loose=()):
+        """
+        parts is (order, tall, max_height) from an index built earlier
+        for the same commands, which skips the sort.
+        """
+        self.display_list = display_list
+        self.loose = list(loose)
+        tops, bottoms = display_list.tops, display_list.bottoms
+        if parts is not None:
+            self.order, self.tall, self.max_height = parts
+        else:
+            skip = set(loose)
+            heights = list(map(sub, bottoms, tops))
+            short = [i for i, height in enumerate(heights)
+                     if height <= TALL_COMMAND and i not in skip]
+            tall = [i for i, height in enumerate(heights)
+                    if height > TALL_COMMAND and i not in skip]
+            self.max_height = max([heights[i] for i in short], default=0)
+            # A stable sort of the positions by top, so ties stay in order
+            self.order = sorted(short, key=tops.__getitem__)
+            self.tall = sorted(tall, key=tops.__getitem__)
+        self.tops = [tops[i] for i in self.order]
+        self.tall_tops = [tops[i] for i in self.tall]
+
+        # Tall commands by height class, each still sorted by top, as
+        # [tallest height, positions, tops]
+        self.buckets = {}
+        for i in self.tall:
+            height = bottoms[i] - tops[i]
+            bucket = self.buckets.setdefault(int(height).bit_length(),
+                                             [0, [], []])
+            bucket[0] = max(bucket[0], height)
+            bucket[1].append(i)
+            bucket[2].append(tops[i])
+
+    def add(self, positions):
+        """
+        Indexes more commands, such as ones just appended to the list.
+        """
+        tops, bottoms = self.display_list.tops, self.display_list.bottoms
+        for i in positions:
+            top, height = tops[i], bottoms[i] - tops[i]
+            if height <= TALL_COMMAND:
+                self.max_height = max(self.max_height, height)
+                insert(self.order, self.tops, i, top)
+                continue
+            insert(self.tall, self.tall_tops, i, top)
+            bucket = self.buckets.setdefault(int(height).bit_length(),
+                                             [0, [], []])
+            bucket[0] = max(bucket[0], height)
+            insert(bucket[1], bucket[2], i, top)
+
+    def visible(self, top, bottom):
+        """
+        Commands overlapping top to bottom, in display list order.
+        """
+        return [self.display_list[i] for i in self.visible_indices(top, bottom)]
+
+    def visible_indices(self, top, bottom):
+        """
+        Display list positions of the commands overlapping top to bottom,
+        in order.
+        """
+        tops, bottoms = self.display_list.tops, self.display_list.bottoms
+        hits = []
+        for max_height, order, order_tops in \
+            [(self.max_height, self.order, self.tops)] \
+                + list(self.buckets.values()):
+            start = bisect_left(order_tops, top - max_height)
+            end = bisect_right(order_tops, bottom)
+            hits.extend(i for i in order[start:end] if bottoms[i] >= top)
+        hits.extend(i for i in self.loose
+                    if tops[i] <= bottom and bottoms[i] >= top)
+        hits.sort()
+        return hits
+
+def insert(order, order_tops, i, top):
+    """
+    Inserts position i into order, which is sorted by order_tops, after
+    any with the same top.
+    """
+    if not order_tops or top >= order_tops[-1]:
+        order.append(i)
+        order_tops.append(top)
+    else:
+        k = bisect_right(order_tops, top)
+        order.insert(k, i)
+        order_tops.insert(k, top)
+
 def get_font(size, weight, style):
     """
     Stores font if not in cache memory, otherwise stores font for future
@@ -48,11 +287,54 @@ def get_font(size, weight, style):
     """
     key = (size, weight, style)
     if key not in FONTS:
-        font = tkinter.font.Font(
-            size=size,
-            weight=weight,
-            slant=style
-            )
-        label = tkinter.Label(font=font)
-        FONTS[key] = (font, label)
-    return FONTS[key][0]
\ No newline at end of file
+        FONTS[key] = BACKEND.create_font(size, weight, style)
+    return FONTS[key]
+
+def set_backend(backend):
+    """
+    Makes get_font create fonts with backend, dropping the fonts and
+    measurements of the previous one.
+    """
+    global BACKEND
+    if backend is BACKEND: return
+    BACKEND = backend
+    FONTS.clear()
+    FONT_METRICS.clear()
+    WORD_WIDTHS.clear()
+    FONT_TABLE.clear()
+    FONT_IDS.clear()
+
+def measure(font, text):
+    """
+    Width of text in font, from an LRU cache of the most recently
+    measured (font, text) pairs.
+    """
+    key = (id(font), text)
+    width = WORD_WIDTHS.get(key)
+    if width is not None:
+        MEASURE_STATS["width_hits"] += 1
+        WORD_WIDTHS.move_to_end(key)
+        return width
+    MEASURE_STATS["width_misses"] += 1
+    count("font measurements")
+    width = WORD_WIDTHS[key] = font.measure(text)
+    if len(WORD_WIDTHS) > MAX_WORD_WIDTHS:
+        WORD_WIDTHS.popitem(last=False)
+    return width
+
+def font_metrics(font, name=None):
+    """
+    font.metrics(), or one metric of it, fetched from Tk once per font.
+    """
+    metrics = FONT_METRICS.get(id(font))
+    if metrics is None:
+        MEASURE_STATS["metrics_misses"] += 1
+        count("font measurements")
+        metrics = FONT_METRICS[id(font)] = font.metrics()
+    else:
+        MEASURE_STATS["metrics_hits"] += 1
+    return metrics if name is None else metrics[name]
+
+def reset_measure_stats():
+    for key in MEASURE_STATS:
+        MEASURE_STATS[key] = 0